@@ -0,0 +1,140 @@
+"""
+Token authentication that remembers the users behind recent tokens
+"""
+
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import AuthToken
+
+
+class TokenCache:
+    """
+    Remembers the user and token behind at most max_size token keys for
+    ttl seconds, and shares them through the cache named alias if given
+    """
+
+    def __init__(self, max_size, ttl, alias=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.alias = alias
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    @staticmethod
+    def get_cache_key(key):
+        """
+        Return the shared cache key of a token, which does not reveal it
+        """
+        return "auth-token:" + hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Return the user and token behind a token key, or None if they
+        are not known or have expired
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if now < entry[1]:
+                    self.entries.move_to_end(key)
+                    return entry[0]
+                del self.entries[key]
+        if self.alias:
+            credentials = caches[self.alias].get(self.get_cache_key(key))
+            if credentials is not None:
+                self.remember(key, credentials, now)
+                return credentials
+        return None
+
+    def set(self, key, credentials):
+        """
+        Remember the user and token behind a token key
+        """
+        self.remember(key, credentials, time.monotonic())
+        if self.alias:
+            caches[self.alias].set(self.get_cache_key(key), credentials, self.ttl)
+
+    def remember(self, key, credentials, now):
+        """
+        Keep credentials in this process, dropping the least recently
+        used ones beyond max_size
+        """
+        with self.lock:
+            self.entries[key] = (credentials, now + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        """
+        Forget the given token keys
+        """
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+        if self.alias and keys:
+            caches[self.alias].delete_many([self.get_cache_key(key) for key in keys])
+
+    def clear(self):
+        """
+        Forget every token known to this process
+        """
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache(
+    max_size=settings.AUTH_TOKEN_CACHE_SIZE,
+    ttl=settings.AUTH_TOKEN_CACHE_TTL,
+    alias=settings.AUTH_TOKEN_CACHE_ALIAS,
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Authentication with expiring AuthTokens that skips the token and user
+    query for tokens resolved in the last AUTH_TOKEN_CACHE_TTL seconds
+    """
+
+    model = AuthToken
+
+    def authenticate_credentials(self, key):
+        """
+        Return the user and token behind a token key, renewing the token
+        """
+        credentials = token_cache.get(key)
+        if credentials is None:
+            credentials = super().authenticate_credentials(key)
+            token_cache.set(key, credentials)
+        user, token = credentials
+        if token.is_expired():
+            token_cache.delete(key)
+            raise AuthenticationFailed("Token has expired.")
+        token.renew()
+        # Every request gets its own user, changes to it stay in the request
+        return copy.copy(user), token
+
+
+def invalidate_token(key):
+    """
+    Stop accepting a deleted token from the cache
+    """
+    token_cache.delete(key)
+
+
+def invalidate_user(user):
+    """
+    Drop the cached tokens of a user whose account has changed
+    """
+    keys = list(AuthToken.objects.filter(user=user).values_list("key", flat=True))
+    token_cache.delete(*keys)
@@ -0,0 +1,32 @@
+"""
+Emails sent to account holders
+"""
+
+from django.template.loader import get_template
+
+# Templates rendering the subject, plain text and HTML body of every email
+EMAIL_TEMPLATES = {
+    "confirm_email": (
+        "user/confirm_email_subject.txt",
+        "user/confirm_email.txt",
+        "user/confirm_email.html",
+    ),
+    "password_reset_email": (
+        "user/password_reset_email_subject.txt",
+        "user/password_reset_email.txt",
+        "user/password_reset_email.html",
+    ),
+}
+
+
+def render_email(name, context):
+    """
+    Return the subject, plain text and HTML body of the given email
+    """
+    # Django's cached loader compiles each template once per process
+    subject, text, html = (get_template(path) for path in EMAIL_TEMPLATES[name])
+    return (
+        " ".join(subject.render(context).split()),
+        text.render(context),
+        html.render(context),
+    )
@@ -0,0 +1,44 @@
+"""
+Management command deleting expired API tokens
+"""
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from authentication.models import AuthToken
+
+
+class Command(BaseCommand):
+    """
+    Delete expired API tokens a chunk at a time
+    """
+
+    help = "Delete expired API tokens in chunks of --batch-size rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of tokens deleted per statement",
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        expired = AuthToken.objects.filter(expires_at__lte=now)
+        deleted = 0
+        # Each chunk is its own short transaction, logins and
+        # renewals never wait on one long delete
+        while True:
+            keys = list(
+                expired.order_by("expires_at").values_list("key", flat=True)[
+                    :options["batch_size"]
+                ]
+            )
+            if not keys:
+                break
+            count, _ = expired.filter(key__in=keys).delete()
+            deleted += count
+            if len(keys) < options["batch_size"]:
+                break
+        self.stdout.write(f"Deleted {deleted} expired token(s)")
@@ -0,0 +1,43 @@
+"""
+Management command deleting accounts whose email was never verified
+"""
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from authentication.models import VERIFICATION_WINDOW, UserAccount
+
+
+class Command(BaseCommand):
+    """
+    Delete unverified accounts whose verification link has expired
+    """
+
+    help = "Delete accounts left unverified past the verification window"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of accounts deleted per batch",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - VERIFICATION_WINDOW
+        expired = UserAccount.objects.filter(is_verified=False, date_joined__lt=cutoff)
+        deleted = 0
+        while True:
+            ids = list(
+                expired.order_by("date_joined").values_list("id", flat=True)[
+                    :options["batch_size"]
+                ]
+            )
+            if not ids:
+                break
+            # Deleting an account also deletes the rows pointing at it
+            _, counts = expired.filter(id__in=ids).delete()
+            deleted += counts.get(UserAccount._meta.label, 0)
+            if len(ids) < options["batch_size"]:
+                break
+        self.stdout.write(f"Deleted {deleted} unverified account(s)")
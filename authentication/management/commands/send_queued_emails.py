@@ -0,0 +1,45 @@
+"""
+Management command running the email outbox worker
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from authentication.outbox import send_queued_emails
+
+
+class Command(BaseCommand):
+    """
+    Send queued emails
+    """
+
+    help = "Send the emails queued by the registration and password reset views"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of polling for new emails",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=5.0,
+            help="Seconds to wait between polls when the queue is empty",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50,
+            help="Number of emails sent per database transaction",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            tried = send_queued_emails(options["batch_size"])
+            if tried:
+                self.stdout.write(f"Processed {tried} email(s)")
+            if options["once"]:
+                return
+            time.sleep(options["poll_interval"])
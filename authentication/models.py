@@ -2,7 +2,11 @@
 Model representing the user authentication
 """
 
+import binascii
+import datetime
+import os
 import uuid
+from django.conf import settings
 from django.contrib.auth.models import (
     AbstractBaseUser,
     PermissionsMixin,
@@ -13,6 +17,10 @@ from django.db import models
 from django.utils import timezone
 
 
+# Time a new user has to verify their email before the account is deleted
+VERIFICATION_WINDOW = datetime.timedelta(days=3)
+
+
 class UserManager(BaseUserManager):
     """
     Custom user manager for managing user creation and authentication.
@@ -50,7 +58,7 @@ class UserAccount(AbstractBaseUser, PermissionsMixin):
     password = models.CharField(max_length=178)
     is_verified = models.BooleanField(default=False)
     date_joined = models.DateTimeField(default=timezone.now)
-    token = models.UUIDField(default=uuid.uuid4, editable=False)
+    token = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     is_superuser = models.BooleanField(default=False)
     is_staff = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
@@ -81,8 +89,131 @@ class UserAccount(AbstractBaseUser, PermissionsMixin):
 
     class Meta:
         """
-        Specifies verbose name
+        Specifies verbose name and indexes
         """
 
         verbose_name = "User Account"
         verbose_name_plural = "User Accounts"
+        # Only covers the few accounts purge_unverified_users looks at
+        indexes = [
+            models.Index(
+                fields=["date_joined"],
+                condition=models.Q(is_verified=False),
+                name="unverified_user_joined_idx",
+            )
+        ]
+
+
+def generate_token_key():
+    """
+    Return a random 40 character token key
+    """
+    return binascii.hexlify(os.urandom(20)).decode()
+
+
+class AuthTokenManager(models.Manager):
+    """
+    Manager handing out the API tokens of users
+    """
+
+    def issue(self, user):
+        """
+        Return the user's unexpired token, renewed, creating one if they
+        have none
+        """
+        now = timezone.now()
+        token = self.filter(user=user, expires_at__gt=now).order_by("-expires_at").first()
+        if token is None:
+            return self.create(
+                user=user,
+                expires_at=now + datetime.timedelta(days=settings.AUTH_TOKEN_LIFETIME),
+            )
+        token.renew(now)
+        return token
+
+
+class AuthToken(models.Model):
+    """
+    API token that stops working AUTH_TOKEN_LIFETIME days after it
+    was last used
+    """
+
+    key = models.CharField(max_length=40, primary_key=True, default=generate_token_key)
+    user = models.ForeignKey(
+        UserAccount, on_delete=models.CASCADE, related_name="auth_tokens"
+    )
+    created = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    objects = AuthTokenManager()
+
+    def __str__(self):
+        """
+        Return the key, like DRF's Token
+        """
+        return self.key
+
+    def is_expired(self, now=None):
+        """
+        Whether the token can no longer be used
+        """
+        return self.expires_at <= (now or timezone.now())
+
+    def renew(self, now=None):
+        """
+        Push the expiry back to AUTH_TOKEN_LIFETIME days from now, writing
+        at most once every AUTH_TOKEN_RENEW_INTERVAL minutes
+        """
+        now = now or timezone.now()
+        lifetime = datetime.timedelta(days=settings.AUTH_TOKEN_LIFETIME)
+        interval = datetime.timedelta(minutes=settings.AUTH_TOKEN_RENEW_INTERVAL)
+        if now - (self.expires_at - lifetime) < interval:
+            return False
+        # Skips the write when another process holding its own copy of the
+        # token renewed it within the interval
+        AuthToken.objects.filter(
+            pk=self.pk, expires_at__lt=now + lifetime - interval
+        ).update(expires_at=now + lifetime)
+        self.expires_at = now + lifetime
+        return True
+
+
+class OutboxEmail(models.Model):
+    """
+    Email waiting to be sent by the send_queued_emails worker
+    """
+
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+    ]
+
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    html_message = models.TextField(blank=True, null=True)
+    from_email = models.CharField(max_length=255, blank=True, null=True)
+    recipients = models.JSONField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # Failed emails are retried once this time has passed
+    send_after = models.DateTimeField(default=timezone.now)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        """
+        Indexes the queue in the order it is drained
+        """
+
+        indexes = [models.Index(fields=["status", "send_after"])]
+
+    def __str__(self):
+        """
+        Return the subject and recipients of the email
+        """
+        return f"{self.subject} to {', '.join(self.recipients)}"
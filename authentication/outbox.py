@@ -0,0 +1,112 @@
+"""
+Database-backed queue of emails sent by a background worker
+"""
+
+import datetime
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+# Number of times an email is tried before it is given up on
+MAX_ATTEMPTS = 5
+
+# Delay before the first retry of a failed email, doubled on every retry
+RETRY_DELAY = datetime.timedelta(minutes=1)
+
+
+def enqueue_email(subject, message, recipient_list, html_message=None, from_email=None):
+    """
+    Queue an email for the worker, taking the arguments of send_mail
+    """
+    return OutboxEmail.objects.create(
+        subject=subject,
+        message=message,
+        html_message=html_message,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        recipients=list(recipient_list),
+    )
+
+
+def build_message(email, connection):
+    """
+    Build the message of the given queued email
+    """
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.message,
+        from_email=email.from_email,
+        to=email.recipients,
+        connection=connection,
+    )
+    if email.html_message:
+        message.attach_alternative(email.html_message, "text/html")
+    return message
+
+
+def send_batch(connection, batch_size):
+    """
+    Send up to batch_size due emails over the given open connection and
+    return how many were tried
+    """
+    now = timezone.now()
+    # Other workers skip the locked rows, an email is sent again only if
+    # the worker dies before the batch is committed
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxEmail.PENDING, send_after__lte=now)
+            .order_by("send_after")[:batch_size]
+        )
+        for index, email in enumerate(emails):
+            try:
+                # Reconnects if a failed email made the server drop us
+                connection.open()
+            # pylint: disable=broad-exception-caught
+            except Exception as exception:
+                # The server is down, leave the rest for the next run
+                logger.error("Could not connect to the email server: %s", exception)
+                emails = emails[:index]
+                break
+            email.attempts += 1
+            try:
+                build_message(email, connection).send()
+            # pylint: disable=broad-exception-caught
+            except Exception as exception:
+                logger.error("Could not send email %s: %s", email.pk, exception)
+                email.error = str(exception)
+                if email.attempts >= MAX_ATTEMPTS:
+                    email.status = OutboxEmail.FAILED
+                else:
+                    email.send_after = now + RETRY_DELAY * 2 ** (email.attempts - 1)
+                connection.close()
+                continue
+            email.status = OutboxEmail.SENT
+            email.sent_at = timezone.now()
+        OutboxEmail.objects.bulk_update(
+            emails, ["status", "attempts", "send_after", "error", "sent_at"]
+        )
+    return len(emails)
+
+
+def send_queued_emails(batch_size=50):
+    """
+    Send every due email in batches over a single SMTP connection and
+    return how many were tried
+    """
+    tried = 0
+    connection = get_connection()
+    try:
+        while True:
+            count = send_batch(connection, batch_size)
+            tried += count
+            if count < batch_size:
+                return tried
+    finally:
+        connection.close()
@@ -1,3 +1,379 @@
-from django.test import TestCase
+import datetime
+import importlib.util
+import io
+import os
+import smtplib
+import time
+import timeit
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core import mail
+from django.core.mail import EmailMultiAlternatives
+from django.contrib.auth.tokens import default_token_generator
+from django.core.management import call_command
+from django.template.loader import render_to_string
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from rest_framework.test import APIClient
+
+from .backends import CachedTokenAuthentication, TokenCache, token_cache
+from .emails import render_email
+from .models import AuthToken, OutboxEmail, UserAccount
+from .outbox import enqueue_email, get_connection
+
+
+def drain(*args):
+    call_command("send_queued_emails", "--once", *args, stdout=io.StringIO())
+
+
+@override_settings(DEFAULT_FROM_EMAIL="noreply@example.com")
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def register(self):
+        return self.client.post(
+            reverse("authentication:register"),
+            {"email": "user@example.com", "password": "password", "username": "user"},
+            HTTP_X_REQUESTED_FROM="https://app.example.com",
+        )
+
+    def test_registration_only_queues_the_email(self):
+        response = self.register()
+        self.assertTrue(response.json()["success"])
+        self.assertEqual(mail.outbox, [])
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.recipients, ["user@example.com"])
+        self.assertEqual(email.subject, "Confirm email")
+        token = response.json()["token"]
+        self.assertIn(f"/auth/verify/{token}/", email.message)
+        self.assertNotIn("<", email.message)
+        self.assertIn(f"/auth/verify/{token}/", email.html_message)
+
+        drain()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["user@example.com"])
+        self.assertEqual(mail.outbox[0].alternatives[0][1], "text/html")
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.SENT)
+
+    def test_unreachable_server_keeps_the_user(self):
+        with mock.patch(
+            "authentication.outbox.EmailMultiAlternatives.send",
+            side_effect=smtplib.SMTPServerDisconnected("gone"),
+        ):
+            self.assertTrue(self.register().json()["success"])
+            with self.assertLogs("authentication.outbox", "ERROR"):
+                drain()
+        self.assertTrue(UserAccount.objects.filter(email="user@example.com").exists())
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.status, OutboxEmail.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertGreater(email.send_after, timezone.now())
+
+    def test_password_reset_queues_the_email(self):
+        UserAccount.objects.create_user(
+            email="user@example.com", password="password", username="user"
+        )
+        response = self.client.post(
+            reverse("authentication:password_reset"), {"email": "user@example.com"}
+        )
+        self.assertTrue(response.json()["success"])
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.subject, "Reset Password")
+        self.assertIn(
+            f"uidb64={response.json()['uidb64']}&token={response.json()['token']}",
+            email.message,
+        )
+
+    def test_queue_is_drained_over_one_connection(self):
+        for index in range(120):
+            enqueue_email("Hello", "Hi", [f"user{index}@example.com"])
+        with mock.patch(
+            "authentication.outbox.get_connection", wraps=get_connection
+        ) as connections:
+            drain("--batch-size", "50")
+        self.assertEqual(connections.call_count, 1)
+        self.assertEqual(len(mail.outbox), 120)
+        self.assertFalse(OutboxEmail.objects.exclude(status=OutboxEmail.SENT).exists())
+
+    def test_failing_email_is_retried_then_given_up(self):
+        enqueue_email("Hello", "Hi", ["bad@example.com"])
+        enqueue_email("Hello", "Hi", ["good@example.com"])
+        send = EmailMultiAlternatives.send
+
+        def send_or_fail(message, *args, **kwargs):
+            if message.to == ["bad@example.com"]:
+                raise smtplib.SMTPRecipientsRefused({})
+            return send(message, *args, **kwargs)
+
+        with mock.patch.object(EmailMultiAlternatives, "send", autospec=True,
+                               side_effect=send_or_fail), \
+                self.assertLogs("authentication.outbox", "ERROR"):
+            for _ in range(5):
+                OutboxEmail.objects.update(send_after=timezone.now())
+                drain()
+
+        self.assertEqual([message.to for message in mail.outbox], [["good@example.com"]])
+        bad = OutboxEmail.objects.get(recipients=["bad@example.com"])
+        self.assertEqual(bad.status, OutboxEmail.FAILED)
+        self.assertEqual(bad.attempts, 5)
+
+
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        self.user = UserAccount.objects.create_user(
+            email="user@example.com", password="password", username="user",
+            is_verified=True,
+        )
+        self.token = AuthToken.objects.issue(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def test_known_token_skips_the_query(self):
+        authentication = CachedTokenAuthentication()
+        user, token = authentication.authenticate_credentials(self.token.key)
+        user.username = "changed"
+        with self.assertNumQueries(0):
+            cached_user, cached_token = authentication.authenticate_credentials(
+                self.token.key
+            )
+        self.assertEqual(cached_user, self.user)
+        self.assertEqual(cached_user.username, "user")
+        self.assertEqual(cached_token, token)
+
+    def test_logout_revokes_the_cached_token(self):
+        self.assertEqual(
+            self.client.post(reverse("authentication:logout")).status_code, 204
+        )
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.assertEqual(
+            self.client.post(reverse("authentication:logout")).status_code, 401
+        )
+
+    def test_deactivated_user_is_rejected(self):
+        url = reverse("authentication:delete-user-data")
+        response = self.client.delete(url, {"user_id": self.user.id}, format="json")
+        self.assertEqual(response.status_code, 200)
+        response = self.client.delete(url, {"user_id": self.user.id}, format="json")
+        self.assertEqual(response.status_code, 401)
+
+    def test_password_reset_drops_the_cached_user(self):
+        CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        response = self.client.post(reverse("authentication:password_reset_confirm"), {
+            "uidb64": urlsafe_base64_encode(force_bytes(self.user.pk)),
+            "token": f"{default_token_generator.make_token(self.user)}:{int(time.time())}",
+            "password1": "new password",
+            "password2": "new password",
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(token_cache.get(self.token.key))
+
+    def test_cache_is_bounded_and_expires(self):
+        cache = TokenCache(max_size=2, ttl=60)
+        for key in ("a", "b", "c"):
+            cache.set(key, (key, key))
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), ("b", "b"))
+        cache.set("d", ("d", "d"))
+        self.assertIsNone(cache.get("c"))
+
+        cache = TokenCache(max_size=2, ttl=0)
+        cache.set("a", ("a", "a"))
+        self.assertIsNone(cache.get("a"))
+
+    def test_shared_cache_resolves_tokens_for_every_process(self):
+        first = TokenCache(max_size=2, ttl=60, alias="default")
+        second = TokenCache(max_size=2, ttl=60, alias="default")
+        first.set(self.token.key, (self.user, self.token))
+        self.assertEqual(second.get(self.token.key), (self.user, self.token))
+        first.delete(self.token.key)
+        second.clear()
+        self.assertIsNone(second.get(self.token.key))
+
+
+@override_settings(AUTH_TOKEN_LIFETIME=14, AUTH_TOKEN_RENEW_INTERVAL=60)
+class AuthTokenTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        self.user = UserAccount.objects.create_user(
+            email="user@example.com", password="password", username="user",
+            is_verified=True,
+        )
+        self.client = APIClient()
+
+    def login(self):
+        return self.client.post(
+            reverse("authentication:login"),
+            {"email": "user@example.com", "password": "password"},
+        )
+
+    def create_token(self, expires_in):
+        return AuthToken.objects.create(
+            user=self.user, expires_at=timezone.now() + expires_in
+        )
+
+    def test_login_returns_the_same_token_until_it_expires(self):
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            set(response.json()), {"user", "success", "message", "token"}
+        )
+        key = response.json()["token"]
+        self.assertEqual(self.login().json()["token"], key)
+
+        AuthToken.objects.update(expires_at=timezone.now())
+        self.assertNotEqual(self.login().json()["token"], key)
+
+    def test_login_renews_the_returned_token(self):
+        token = self.create_token(datetime.timedelta(minutes=1))
+        self.assertEqual(self.login().json()["token"], token.key)
+        token.refresh_from_db()
+        self.assertGreater(
+            token.expires_at, timezone.now() + datetime.timedelta(days=13, hours=23)
+        )
+
+    def test_expired_token_is_rejected(self):
+        token = self.create_token(datetime.timedelta(days=1))
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        CachedTokenAuthentication().authenticate_credentials(token.key)
+        AuthToken.objects.update(expires_at=timezone.now())
+        token_cache.get(token.key)[1].expires_at = timezone.now()
+
+        response = self.client.post(reverse("authentication:logout"))
+        self.assertEqual(response.status_code, 401)
+        self.assertIsNone(token_cache.get(token.key))
+
+    def test_token_is_renewed_at_most_once_per_interval(self):
+        authentication = CachedTokenAuthentication()
+        fresh = self.create_token(datetime.timedelta(days=14, minutes=-30))
+        with self.assertNumQueries(1):
+            authentication.authenticate_credentials(fresh.key)
+
+        stale = self.create_token(datetime.timedelta(days=13))
+        with self.assertNumQueries(2):
+            authentication.authenticate_credentials(stale.key)
+        with self.assertNumQueries(0):
+            authentication.authenticate_credentials(stale.key)
+        stale.refresh_from_db()
+        self.assertGreater(
+            stale.expires_at, timezone.now() + datetime.timedelta(days=13, hours=23)
+        )
+
+    def test_stale_copy_does_not_renew_again(self):
+        token = self.create_token(datetime.timedelta(days=13))
+        stale = AuthToken.objects.get(key=token.key)
+        now = timezone.now()
+        self.assertTrue(token.renew(now))
+
+        stale.renew(now + datetime.timedelta(minutes=1))
+        self.assertEqual(
+            AuthToken.objects.get(key=token.key).expires_at,
+            now + datetime.timedelta(days=14),
+        )
+
+    def test_purge_deletes_expired_tokens_in_chunks(self):
+        for _ in range(5):
+            self.create_token(datetime.timedelta(minutes=-1))
+        valid = self.create_token(datetime.timedelta(days=1))
+        out = io.StringIO()
+        with self.assertNumQueries(6):
+            call_command("purge_expired_tokens", "--batch-size", "2", stdout=out)
+        self.assertIn("Deleted 5 expired token(s)", out.getvalue())
+        self.assertEqual(list(AuthToken.objects.all()), [valid])
+
+    def test_api_token_auth_issues_an_expiring_token(self):
+        response = self.client.post(
+            reverse("authentication:api_token_auth"),
+            {"username": "user@example.com", "password": "password"},
+        )
+        self.assertEqual(response.status_code, 200)
+        token = AuthToken.objects.get(key=response.json()["token"])
+        self.assertFalse(token.is_expired())
+
+
+class VerificationTests(TestCase):
+    def create_user(self, name, days_ago, is_verified=False):
+        return UserAccount.objects.create_user(
+            email=f"{name}@example.com", password="password", username=name,
+            is_verified=is_verified,
+            date_joined=timezone.now() - datetime.timedelta(days=days_ago),
+        )
+
+    def test_verify_looks_the_token_up_through_the_index(self):
+        user = self.create_user("user", 0)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse("authentication:verify"), {"token": str(user.token)}
+            )
+        self.assertTrue(response.json()["success"])
+        lookup = queries[0]["sql"]
+        self.assertIn('"token" =', lookup)
+        with connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {lookup}")
+            plan = " ".join(str(row) for row in cursor.fetchall())
+        self.assertRegex(plan, r"USING (COVERING )?INDEX|Index Scan")
+
+    def test_purge_deletes_expired_unverified_accounts_in_batches(self):
+        for index in range(5):
+            self.create_user(f"old{index}", 4)
+        recent = self.create_user("recent", 1)
+        verified = self.create_user("verified", 30, is_verified=True)
+        out = io.StringIO()
+        call_command("purge_unverified_users", "--batch-size", "2", stdout=out)
+        self.assertIn("Deleted 5 unverified account(s)", out.getvalue())
+        self.assertEqual(
+            set(UserAccount.objects.all()), {recent, verified}
+        )
+
+    def test_purge_uses_the_partial_index(self):
+        cutoff = timezone.now() - datetime.timedelta(days=3)
+        plan = UserAccount.objects.filter(
+            is_verified=False, date_joined__lt=cutoff
+        ).explain()
+        self.assertRegex(plan, r"unverified_user_joined_idx")
+
+
+@skipUnless(os.getenv("RUN_BENCHMARKS"), "set RUN_BENCHMARKS=1 to run benchmarks")
+@skipUnless(importlib.util.find_spec("bs4"), "needs bs4 for the parsed baseline")
+class RenderEmailBenchmark(SimpleTestCase):
+    def test_templates_are_cheaper_than_parsing(self):
+        # pylint: disable=import-outside-toplevel
+        from bs4 import BeautifulSoup
+
+        context = {
+            "user": {"username": "user"},
+            "site_url": "app.example.com",
+            "token": "9b2f3c1e-6a57-4a5e-8a0c-1d2e3f4a5b6c",
+        }
+        rounds = 200
+
+        def parse():
+            html = render_to_string("user/confirm_email.html", context)
+            soup = BeautifulSoup(html, "html.parser")
+            subject = soup.title.string.strip()
+            message = "\n".join(
+                element.get_text().strip()
+                for element in soup.find_all("td", class_="content-block")
+            )
+            return subject, message, html
+
+        render_email("confirm_email", context)
+        per_parse = timeit.Timer(parse, timer=time.process_time).timeit(rounds) / rounds
+        per_render = timeit.Timer(
+            lambda: render_email("confirm_email", context), timer=time.process_time
+        ).timeit(rounds) / rounds
+
+        print(
+            f"\nrender and parse: {per_parse * 1000:.2f} ms CPU/email, "
+            f"render_email(): {per_render * 1000:.2f} ms CPU/email"
+        )
+        self.assertLess(per_render, per_parse)
@@ -2,14 +2,13 @@
 URL configuration module for the auth app.
 """
 
-from rest_framework.authtoken.views import obtain_auth_token
 from django.urls import path
 from . import views
 
 app_name = "authentication"
 
 urlpatterns = [
-    path("api-token-auth/", obtain_auth_token, name="api_token_auth"),
+    path("api-token-auth/", views.ObtainAuthTokenView.as_view(), name="api_token_auth"),
     path("api/v1/register/", views.RegistrationView.as_view(), name="register"),
     path("api/v1/login/", views.LoginView.as_view(), name="login"),
     path("api/v1/logout/", views.LogoutView.as_view(), name="logout"),
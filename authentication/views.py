@@ -8,19 +8,15 @@ import uuid
 
 from datetime import timedelta, datetime
 from urllib.parse import urlparse, unquote
-from django.core.mail import send_mail
 from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.tokens import default_token_generator
-from django.template.loader import render_to_string
-from bs4 import BeautifulSoup
 from django.utils import timezone
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.views.decorators.csrf import csrf_protect
 from rest_framework import status
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.authtoken.models import Token
+from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
@@ -30,7 +26,10 @@ from django.contrib.auth import get_user_model
 
 import pytz
 
-from .models import UserAccount
+from .backends import CachedTokenAuthentication, invalidate_token, invalidate_user
+from .emails import render_email
+from .models import VERIFICATION_WINDOW, AuthToken, UserAccount
+from .outbox import enqueue_email
 from .serializers import UserSerializer
 
 User = get_user_model()
@@ -63,15 +62,9 @@ class RegistrationView(APIView):
                     "site_url": site_url,
                     "token": token,
                 }
-                email_html = render_to_string("user/confirm_email.html", email_context)
-                soup = BeautifulSoup(email_html, "html.parser")
-                subject = soup.title.string.strip()
-
-                message_elements = soup.find_all("td", class_="content-block")
-                message_parts = [
-                    element.get_text().strip() for element in message_elements
-                ]
-                message = "\n".join(message_parts)
+                subject, message, email_html = render_email(
+                    "confirm_email", email_context
+                )
                 sender_email = settings.DEFAULT_FROM_EMAIL
                 recipient_list = [email]
                 success_message = (
@@ -79,13 +72,14 @@ class RegistrationView(APIView):
                     "Verify your account with the email sent to you."
                 )
 
-                send_mail(
+                # The outbox worker sends it, a slow or unreachable
+                # email server no longer holds up or fails the request
+                enqueue_email(
                     subject=subject,
                     message=message,
                     from_email=sender_email,
                     recipient_list=recipient_list,
                     html_message=email_html,
-                    fail_silently=False,
                 )
                 response_data = {
                     "message": success_message,
@@ -139,28 +133,21 @@ class RequestNewLinkView(APIView):
                     "site_url": site_url,
                     "token": token,
                 }
-                email_html = render_to_string("user/confirm_email.html", email_context)
-                soup = BeautifulSoup(email_html, "html.parser")
-                subject = soup.title.string.strip()
-
-                message_elements = soup.find_all("td", class_="content-block")
-                message_parts = [
-                    element.get_text().strip() for element in message_elements
-                ]
-                message = "\n".join(message_parts)
+                subject, message, email_html = render_email(
+                    "confirm_email", email_context
+                )
                 sender_email = settings.DEFAULT_FROM_EMAIL
                 recipient_list = [email]
                 success_message = (
                     "New email verification link has been sent. "
                     "Please check your email."
                 )
-                send_mail(
+                enqueue_email(
                     subject=subject,
                     message=message,
                     from_email=sender_email,
                     recipient_list=recipient_list,
                     html_message=email_html,
-                    fail_silently=False,
                 )
                 response_data = {
                     "message": success_message,
@@ -179,7 +166,7 @@ class LoginView(APIView):
     API view for user login.
     """
 
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [AllowAny]
 
     def post(self, request):
@@ -193,7 +180,7 @@ class LoginView(APIView):
             if user.is_verified:
                 login(request, user)
                 # pylint: disable=E1101
-                token, created = Token.objects.get_or_create(user=user)
+                token = AuthToken.objects.issue(user)
                 return Response(
                     {
                         "user": user.id,
@@ -210,19 +197,36 @@ class LoginView(APIView):
         )
 
 
+class ObtainAuthTokenView(ObtainAuthToken):
+    """
+    API view exchanging credentials for an expiring token.
+    """
+
+    def post(self, request, *args, **kwargs):
+        """
+        Handle POST request for a token.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        token = AuthToken.objects.issue(serializer.validated_data["user"])
+        return Response({"token": token.key})
+
+
 class LogoutView(APIView):
     """
     API view for user logout.
     """
 
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
         """
         Handle POST request for user logout.
         """
-        request.user.auth_token.delete()
+        key = request.auth.key
+        AuthToken.objects.filter(key=key).delete()
+        invalidate_token(key)
         logout(request)
         return Response({"message": None}, status=status.HTTP_204_NO_CONTENT)
 
@@ -243,7 +247,7 @@ def verify(request):
         user = None
 
     if user is not None and not user.is_verified:
-        if timezone.now() <= user.date_joined + timedelta(days=3):
+        if timezone.now() <= user.date_joined + VERIFICATION_WINDOW:
             user.is_verified = True
             user.save()
             data = {"success": True, "message": "Your account is verified"}
@@ -281,8 +285,8 @@ def password_reset(request):
         uidb64 = urlsafe_base64_encode(force_bytes(user.pk))
 
         domain = request.headers.get("X-Requested-From")
-        email_html = render_to_string(
-            "user/password_reset_email.html",
+        subject, message, email_html = render_email(
+            "password_reset_email",
             {
                 "protocol": "https",
                 "domain": domain,
@@ -290,18 +294,14 @@ def password_reset(request):
                 "token": token,
             },
         )
-        soup = BeautifulSoup(email_html, "html.parser")
-        subject = soup.title.string.strip()
-        message = soup.find_all("p")[0].get_text()
         sender_email = settings.DEFAULT_FROM_EMAIL
         to_email = [email]
-        send_mail(
+        enqueue_email(
             subject=subject,
             message=message,
             from_email=sender_email,
             html_message=email_html,
             recipient_list=to_email,
-            fail_silently=False,
         )
         success_message = "Password reset link has been sent to your email."
         data = {
@@ -358,6 +358,7 @@ def password_reset_confirm(request):
                     )
                 user.set_password(password1)
                 user.save()
+                invalidate_user(user)
                 user = authenticate(username=user.username, password=password1)
                 return Response(
                     {"success": "Password reset successful."},
@@ -400,6 +401,7 @@ class DeleteUserDataView(APIView):
         user.is_deleted = True
         user.is_active = False  # Deactivate the user account
         user.save()
+        invalidate_user(user)
 
         return Response(
             {"message": "User data deleted successfully."},
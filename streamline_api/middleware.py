@@ -0,0 +1,20 @@
+"""
+Project-wide middleware
+"""
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Gzips the responses of the COMPRESSION_PATHS routes once they are
+    larger than COMPRESSION_MIN_SIZE bytes
+    """
+
+    def process_response(self, request, response):
+        if not request.path.startswith(tuple(settings.COMPRESSION_PATHS)):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        return super().process_response(request, response)
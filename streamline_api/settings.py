@@ -91,6 +91,8 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "streamline_api.middleware.CompressionMiddleware",
+    "django.middleware.http.ConditionalGetMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -101,6 +103,11 @@ MIDDLEWARE = [
 
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 
+# Responses of these routes are gzipped once larger than COMPRESSION_MIN_SIZE
+# bytes, smaller ones are not worth the CPU
+COMPRESSION_PATHS = ["/api/v1/youtube/"]
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+
 CORS_ALLOWED_ORIGINS = [
     'https://www.app.devnetwork.tech',
     'https://app.devnetwork.tech',
@@ -204,7 +211,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "authentication.backends.CachedTokenAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
@@ -225,3 +232,80 @@ SITE_NAME = "Streamline"
 TIKTOK_APP_ID = os.getenv("TIKTOK_APP_ID")
 TIKTOK_CLIENT_KEY = os.getenv("TIKTOK_CLIENT_KEY")
 TIKTOK_CLIENT_SECRET = os.getenv("TIKTOK_CLIENT_SECRET")
+
+# Videos waiting for the upload worker are kept here until they reach YouTube
+YOUTUBE_UPLOAD_DIR = os.getenv("YOUTUBE_UPLOAD_DIR", os.path.join(MEDIA_ROOT, "youtube_uploads"))
+
+# Videos posted to the upload endpoint with pipeline=true are forwarded to
+# YouTube while they are received
+FILE_UPLOAD_HANDLERS = [
+    "youtube.upload_handlers.YouTubeStreamingUploadHandler",
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+
+# Size of each resumable upload chunk, rounded down to a multiple of 256 KiB
+YOUTUBE_UPLOAD_CHUNK_SIZE = int(os.getenv("YOUTUBE_UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+
+# YouTube Data API quota units the whole project may spend per day, and the
+# rate at which a single user's token bucket refills
+YOUTUBE_QUOTA_DAILY_LIMIT = int(os.getenv("YOUTUBE_QUOTA_DAILY_LIMIT", 10000))
+YOUTUBE_QUOTA_USER_DAILY_LIMIT = int(os.getenv("YOUTUBE_QUOTA_USER_DAILY_LIMIT", 2500))
+
+# Calls to the YouTube Data API give up on a silent socket after
+# YOUTUBE_API_TIMEOUT seconds and stop retrying after YOUTUBE_API_DEADLINE
+YOUTUBE_API_TIMEOUT = float(os.getenv("YOUTUBE_API_TIMEOUT", 10))
+YOUTUBE_API_DEADLINE = float(os.getenv("YOUTUBE_API_DEADLINE", 30))
+YOUTUBE_API_MAX_BACKOFF = float(os.getenv("YOUTUBE_API_MAX_BACKOFF", 8))
+
+# Consecutive failures after which calls fail fast, and the number of
+# seconds before a trial call is let through again
+YOUTUBE_API_BREAKER_THRESHOLD = int(os.getenv("YOUTUBE_API_BREAKER_THRESHOLD", 5))
+YOUTUBE_API_BREAKER_RESET = float(os.getenv("YOUTUBE_API_BREAKER_RESET", 30))
+
+# Minutes a user has to complete the YouTube authorization flow before its
+# state is rejected and purged
+YOUTUBE_OAUTH_STATE_TTL = int(os.getenv("YOUTUBE_OAUTH_STATE_TTL", 10))
+
+# OAuth client of the YouTube integration. The secrets file is read once at
+# startup, send SIGHUP to a web worker to reload it
+YOUTUBE_CLIENT_SECRETS_FILE = os.getenv(
+    "YOUTUBE_CLIENT_SECRETS_FILE", os.path.join(BASE_DIR, "youtube", "Sss.json")
+)
+YOUTUBE_OAUTH_SCOPES = [
+    "https://www.googleapis.com/auth/youtube.readonly",
+    "https://www.googleapis.com/auth/userinfo.profile",
+    "https://www.googleapis.com/auth/youtube.force-ssl",
+]
+YOUTUBE_OAUTH_REDIRECT_URI = os.getenv(
+    "YOUTUBE_OAUTH_REDIRECT_URI", "https://app.devnetwork.tech/user/youtube-callback"
+)
+
+# Keep-alive connections to Google are kept per thread, for at most
+# YOUTUBE_HTTP_POOL_SIZE threads and YOUTUBE_HTTP_IDLE_TIMEOUT idle seconds
+YOUTUBE_HTTP_POOL_SIZE = int(os.getenv("YOUTUBE_HTTP_POOL_SIZE", 32))
+YOUTUBE_HTTP_IDLE_TIMEOUT = float(os.getenv("YOUTUBE_HTTP_IDLE_TIMEOUT", 60))
+
+# Number of videos the upload worker sends at the same time, at most
+# YOUTUBE_UPLOAD_USER_CONCURRENCY of them for the same user, and the number
+# of videos accepted by one batch upload request
+YOUTUBE_UPLOAD_WORKERS = int(os.getenv("YOUTUBE_UPLOAD_WORKERS", 4))
+YOUTUBE_UPLOAD_USER_CONCURRENCY = int(os.getenv("YOUTUBE_UPLOAD_USER_CONCURRENCY", 2))
+YOUTUBE_UPLOAD_BATCH_MAX_FILES = int(os.getenv("YOUTUBE_UPLOAD_BATCH_MAX_FILES", 20))
+
+# Number of token keys whose user every process remembers, and for how many
+# seconds, which bounds how long a revoked token keeps working in the other
+# processes. AUTH_TOKEN_CACHE_ALIAS names a cache shared by all processes
+# to resolve each token once for all of them
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 1024))
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", 30))
+AUTH_TOKEN_CACHE_ALIAS = os.getenv("AUTH_TOKEN_CACHE_ALIAS") or None
+
+# Days an API token keeps working after it was last used, and minutes
+# between two renewals of its expiry
+AUTH_TOKEN_LIFETIME = int(os.getenv("AUTH_TOKEN_LIFETIME", 14))
+AUTH_TOKEN_RENEW_INTERVAL = int(os.getenv("AUTH_TOKEN_RENEW_INTERVAL", 60))
+
+# Threads shared by the bulk video endpoint and the statistics refresh to
+# call YouTube concurrently
+YOUTUBE_FETCH_WORKERS = int(os.getenv("YOUTUBE_FETCH_WORKERS", 8))
@@ -11,6 +11,12 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from youtube.oauth import install_reload_handler
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "streamline_api.settings")
 
 application = get_wsgi_application()
+
+# Only web workers reload the OAuth client on SIGHUP, management commands
+# keep exiting on a hangup
+install_reload_handler()
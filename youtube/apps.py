@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class YoutubeConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "youtube"
+
+    def ready(self):
+        from .oauth import load_client_config
+
+        load_client_config()
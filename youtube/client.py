@@ -0,0 +1,102 @@
+"""
+Process-wide factory for YouTube Data API clients
+"""
+
+import json
+import threading
+from functools import partial
+
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import HttpRequest
+
+from .execution import call_once, call_with_retries
+from .quota import consume_quota
+from .transport import http_pool
+
+API_SERVICE_NAME = "youtube"
+API_VERSION = "v3"
+
+_discovery_document = None
+_discovery_lock = threading.Lock()
+
+
+def get_discovery_document():
+    """
+    Return the parsed YouTube discovery document, loading the copy
+    bundled with google-api-python-client once per process
+    """
+    global _discovery_document
+    if _discovery_document is None:
+        with _discovery_lock:
+            if _discovery_document is None:
+                content = get_static_doc(API_SERVICE_NAME, API_VERSION)
+                if content is None:
+                    raise RuntimeError(
+                        f"No bundled discovery document for "
+                        f"{API_SERVICE_NAME} {API_VERSION}"
+                    )
+                _discovery_document = json.loads(content)
+    return _discovery_document
+
+
+class MeteredHttpRequest(HttpRequest):
+    """
+    HttpRequest charging its quota cost to a user before it is sent and
+    retrying transient errors behind the circuit breaker
+    """
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = user
+        self.charged = False
+
+    def charge(self):
+        """
+        Charge the call once, however many chunks it takes
+        """
+        if self.user is not None and not self.charged:
+            consume_quota(self.user, self.methodId)
+            self.charged = True
+
+    def execute(self, http=None, num_retries=0):
+        # A resumed upload session has already been paid for
+        if self.resumable is None or self.resumable_uri is None:
+            self.charge()
+        if self.resumable is not None:
+            # Uploads go through next_chunk, guarded chunk by chunk
+            return super().execute(http=http, num_retries=num_retries)
+        return call_with_retries(
+            partial(super().execute, http=http, num_retries=num_retries)
+        )
+
+    def next_chunk(self, http=None, num_retries=0):
+        if self.resumable_uri is None:
+            self.charge()
+        # Upload chunks are retried by the upload worker, which resumes
+        # the session instead of sending the chunk again blindly
+        return call_once(
+            partial(super().next_chunk, http=http, num_retries=num_retries)
+        )
+
+
+def build_transport(credentials):
+    """
+    Return the keep-alive transport of the calling thread authorized
+    with the given credentials
+    """
+    return AuthorizedHttp(credentials, http=http_pool.get())
+
+
+def build_youtube(credentials, user=None):
+    """
+    Return a YouTube Data API client bound to the given credentials,
+    charging the quota of every call to the given user. The client must
+    be used by the thread that built it
+    """
+    return build_from_document(
+        get_discovery_document(),
+        http=build_transport(credentials),
+        requestBuilder=partial(MeteredHttpRequest, user=user),
+    )
@@ -0,0 +1,87 @@
+"""
+Per-user cache of live YouTube OAuth credentials
+"""
+
+import datetime
+import json
+import threading
+from collections import OrderedDict
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+
+from .models import YouTubeCredentials
+from .transport import session_pool
+
+# Maximum number of users whose credentials are kept in memory
+CACHE_SIZE = 1024
+
+# Refresh access tokens this long before they actually expire
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _needs_refresh(credentials):
+    """
+    Check if the access token is missing or about to expire
+    """
+    if not credentials.refresh_token:
+        return False
+    if not credentials.token:
+        return True
+    if credentials.expiry is None:
+        return False
+    # google-auth stores expiry as a naive UTC datetime
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return credentials.expiry - REFRESH_MARGIN <= now
+
+
+def get_credentials(user):
+    """
+    Return the live credentials of the given user, or None if they
+    have not connected their YouTube account
+    """
+    with _lock:
+        entry = _cache.get(user.pk)
+        if entry is not None:
+            _cache.move_to_end(user.pk)
+
+    if entry is None:
+        stored = YouTubeCredentials.objects.filter(user=user).only("pk", "credentials").first()
+        if stored is None:
+            return None
+        credentials_data = json.loads(stored.credentials)
+        entry = (stored.pk, Credentials.from_authorized_user_info(credentials_data))
+        with _lock:
+            _cache[user.pk] = entry
+            _cache.move_to_end(user.pk)
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    stored_pk, credentials = entry
+    if _needs_refresh(credentials):
+        # Refresh ahead of expiry and write the new token back so other
+        # workers and later requests don't have to refresh it again
+        credentials.refresh(Request(session_pool.get()))
+        YouTubeCredentials.objects.filter(pk=stored_pk).update(
+            credentials=credentials.to_json()
+        )
+    return credentials
+
+
+def invalidate_credentials(user):
+    """
+    Drop the cached credentials of the given user
+    """
+    with _lock:
+        _cache.pop(user.pk, None)
+
+
+def clear_credentials_cache():
+    """
+    Drop every cached credential
+    """
+    with _lock:
+        _cache.clear()
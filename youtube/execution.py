@@ -0,0 +1,220 @@
+"""
+Retries, deadlines and circuit breaking for YouTube Data API calls
+"""
+
+import random
+import threading
+import time
+
+import httplib2
+from django.conf import settings
+from googleapiclient.errors import HttpError
+from rest_framework.exceptions import APIException
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+# 403 errors with these reasons are transient, not missing permissions
+RETRYABLE_REASONS = ("rateLimitExceeded", "userRateLimitExceeded", "backendError")
+
+# Statuses and 403 reasons that throttle the caller rather than show
+# YouTube is failing, they are retried without tripping the breaker
+THROTTLING_STATUSES = (429,)
+THROTTLING_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+
+class YouTubeUnavailable(APIException):
+    """
+    Raised when YouTube cannot be reached or the circuit breaker is open
+    """
+
+    status_code = 503
+    default_detail = "YouTube is unavailable, try again later."
+    default_code = "youtube_unavailable"
+
+
+def get_error_reasons(exception):
+    """
+    Return the reasons given by YouTube for an HttpError
+    """
+    return [detail.get("reason") for detail in exception.error_details or []
+            if isinstance(detail, dict)]
+
+
+def is_retryable_error(exception):
+    """
+    Check if the given error is transient and the call worth retrying
+    """
+    if isinstance(exception, HttpError):
+        if exception.resp.status in RETRYABLE_STATUSES:
+            return True
+        if exception.resp.status == 403:
+            return any(
+                reason in RETRYABLE_REASONS for reason in get_error_reasons(exception)
+            )
+        return False
+    return isinstance(exception, (httplib2.HttpLib2Error, OSError))
+
+
+def is_throttling_error(exception):
+    """
+    Check if the given error is YouTube slowing the caller down
+    """
+    if not isinstance(exception, HttpError):
+        return False
+    if exception.resp.status in THROTTLING_STATUSES:
+        return True
+    return exception.resp.status == 403 and any(
+        reason in THROTTLING_REASONS for reason in get_error_reasons(exception)
+    )
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast once the API failed too many times in a row, letting
+    a single trial call through after reset_timeout seconds
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Close the breaker and zero its counters
+        """
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def allow(self):
+        """
+        Check if a call may go through, counting it if so
+        """
+        with self.lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.counters["rejected"] += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self.trial_running = False
+            if self.state == self.HALF_OPEN:
+                if self.trial_running:
+                    self.counters["rejected"] += 1
+                    return False
+                self.trial_running = True
+            self.counters["calls"] += 1
+            return True
+
+    def record_success(self):
+        """
+        Close the breaker after a call that reached the API
+        """
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trial_running = False
+
+    def record_failure(self):
+        """
+        Count a transient failure, opening the breaker at the threshold
+        """
+        with self.lock:
+            self.failures += 1
+            self.counters["failures"] += 1
+            self.trial_running = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.counters["opened"] += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """
+        Let another trial call through after one that never reached the API
+        """
+        with self.lock:
+            self.trial_running = False
+
+    def record_retry(self):
+        """
+        Count a retried call
+        """
+        with self.lock:
+            self.counters["retries"] += 1
+
+    def metrics(self):
+        """
+        Return the state and counters of the breaker
+        """
+        with self.lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                **self.counters,
+            }
+
+
+breaker = CircuitBreaker(
+    failure_threshold=settings.YOUTUBE_API_BREAKER_THRESHOLD,
+    reset_timeout=settings.YOUTUBE_API_BREAKER_RESET,
+)
+
+
+def get_backoff(attempt):
+    """
+    Return the delay before the given retry, with full jitter
+    """
+    return random.uniform(0, min(settings.YOUTUBE_API_MAX_BACKOFF, 2 ** attempt))
+
+
+def call_once(call):
+    """
+    Run call through the circuit breaker, recording how it went
+    """
+    if not breaker.allow():
+        raise YouTubeUnavailable()
+    try:
+        result = call()
+    except Exception as exception:
+        if is_retryable_error(exception) and not is_throttling_error(exception):
+            breaker.record_failure()
+        elif isinstance(exception, HttpError):
+            # The API answered, it just did not like or throttled the request
+            breaker.record_success()
+        else:
+            breaker.release()
+        raise
+    breaker.record_success()
+    return result
+
+
+def call_with_retries(call, deadline=None):
+    """
+    Run call, retrying transient errors with jittered exponential backoff
+    until it succeeds or the deadline in seconds passes
+    """
+    if deadline is None:
+        deadline = settings.YOUTUBE_API_DEADLINE
+    give_up_at = time.monotonic() + deadline
+    attempt = 0
+    while True:
+        try:
+            return call_once(call)
+        # pylint: disable=broad-exception-caught
+        except Exception as exception:
+            if not is_retryable_error(exception):
+                raise
+            delay = get_backoff(attempt)
+            if time.monotonic() + delay >= give_up_at:
+                raise YouTubeUnavailable() from exception
+        breaker.record_retry()
+        attempt += 1
+        time.sleep(delay)
@@ -0,0 +1,43 @@
+"""
+Management command moving credentials out of the OAuthState table
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from youtube.models import OAuthState, YouTubeCredentials
+
+
+class Command(BaseCommand):
+    """
+    Keep the newest stored credentials of every user as their single
+    YouTubeCredentials row and delete the OAuthState rows holding them
+    """
+
+    help = "Move credentials stored on OAuthState rows to YouTubeCredentials"
+
+    def handle(self, *args, **options):
+        legacy = OAuthState.objects.filter(credentials__isnull=False).exclude(credentials="")
+        newest = {}
+        for user_id, credentials in legacy.order_by("pk").values_list("user", "credentials"):
+            newest[user_id] = credentials
+
+        with transaction.atomic():
+            connected = set(
+                YouTubeCredentials.objects.filter(user__in=newest).values_list("user", flat=True)
+            )
+            # Credentials saved by the new callback are newer than any copy
+            YouTubeCredentials.objects.bulk_create(
+                [
+                    YouTubeCredentials(user_id=user_id, credentials=credentials)
+                    for user_id, credentials in newest.items()
+                    if user_id not in connected
+                ],
+                batch_size=500,
+            )
+            deleted, _ = OAuthState.objects.filter(credentials__isnull=False).delete()
+
+        self.stdout.write(
+            f"Moved credentials of {len(newest) - len(connected)} user(s), "
+            f"deleted {deleted} row(s)"
+        )
@@ -0,0 +1,35 @@
+"""
+Management command deleting expired YouTube authorization states
+"""
+
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from youtube.models import OAuthState
+
+
+class Command(BaseCommand):
+    """
+    Delete authorization states nobody came back for
+    """
+
+    help = "Delete YouTube authorization states older than --older-than minutes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=int,
+            default=settings.YOUTUBE_OAUTH_STATE_TTL,
+            help="Age in minutes after which a pending state is deleted",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(minutes=options["older_than"])
+        # Rows still holding credentials wait for dedupe_oauth_states
+        deleted, _ = OAuthState.objects.filter(
+            created_at__lt=cutoff, credentials__isnull=True
+        ).delete()
+        self.stdout.write(f"Deleted {deleted} expired state(s)")
@@ -0,0 +1,83 @@
+"""
+Management command refreshing the statistics of stored videos
+"""
+
+import datetime
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from youtube.credentials import get_credentials
+from youtube.sync import get_stale_channels, refresh_video_statistics
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Refresh the like, comment and view counts of every connected channel
+    """
+
+    help = "Refresh the like, comment and view counts of every connected channel"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hot-after",
+            type=int,
+            default=15,
+            help="Minutes after which the statistics of a hot channel are stale",
+        )
+        parser.add_argument(
+            "--idle-after",
+            type=int,
+            default=360,
+            help="Minutes after which the statistics of an idle channel are stale",
+        )
+        parser.add_argument(
+            "--hot-days",
+            type=int,
+            default=7,
+            help="Channels that published a video within this many days are hot",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Maximum number of concurrent YouTube calls per channel",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep refreshing instead of exiting after one pass",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=60.0,
+            help="Seconds to wait between passes with --loop",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            channels = get_stale_channels(
+                hot_after=datetime.timedelta(minutes=options["hot_after"]),
+                idle_after=datetime.timedelta(minutes=options["idle_after"]),
+                hot_window=datetime.timedelta(days=options["hot_days"]),
+            )
+            for channel in channels:
+                try:
+                    credentials = get_credentials(channel.user)
+                    if credentials is None:
+                        continue
+                    changed = refresh_video_statistics(
+                        channel.user, credentials, max_workers=options["workers"]
+                    )
+                    self.stdout.write(f"{channel.user}: {changed} video(s) changed")
+                # pylint: disable=broad-exception-caught
+                except Exception as exception:
+                    # One broken channel must not stop the others
+                    logger.error(str(exception))
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,46 @@
+"""
+Management command running the YouTube upload worker
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from youtube.uploads import run_pending_jobs
+
+
+class Command(BaseCommand):
+    """
+    Upload queued videos to YouTube
+    """
+
+    help = "Upload queued videos to YouTube"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of polling for new jobs",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=5.0,
+            help="Seconds to wait between polls when the queue is empty",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.YOUTUBE_UPLOAD_WORKERS,
+            help="Number of videos uploaded at the same time",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed = run_pending_jobs(options["workers"])
+            if processed:
+                self.stdout.write(f"Processed {processed} upload job(s)")
+            if options["once"]:
+                return
+            time.sleep(options["poll_interval"])
@@ -1,11 +1,231 @@
 from django.db import models
+from django.utils import timezone
 from authentication.models import UserAccount
 
 
 class OAuthState(models.Model):
+    """
+    An authorization flow started by a user and waiting for its callback,
+    purged once older than YOUTUBE_OAUTH_STATE_TTL minutes
+    """
+
     user = models.ForeignKey(UserAccount, on_delete=models.CASCADE)
     state = models.CharField(max_length=255)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Credentials stored here before they had their own table, moved to
+    # YouTubeCredentials by the dedupe_oauth_states command
     credentials = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "state"]),
+            models.Index(fields=["created_at"]),
+        ]
+
     def __str__(self):
         return self.state
+
+
+class YouTubeCredentials(models.Model):
+    """
+    OAuth credentials of a user's connected YouTube account
+    """
+
+    user = models.OneToOneField(UserAccount, on_delete=models.CASCADE)
+    credentials = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.user)
+
+
+class UploadBatch(models.Model):
+    """
+    Videos uploaded together in one batch upload request
+    """
+
+    user = models.ForeignKey(UserAccount, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user} ({self.created_at})"
+
+
+class UploadJob(models.Model):
+    """
+    A video waiting to be, or being, uploaded to YouTube by the
+    upload worker
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (COMPLETED, "Completed"),
+        (FAILED, "Failed"),
+    ]
+
+    user = models.ForeignKey(UserAccount, on_delete=models.CASCADE)
+    batch = models.ForeignKey(
+        UploadBatch, on_delete=models.SET_NULL, blank=True, null=True, related_name="jobs"
+    )
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    file_path = models.CharField(max_length=1024)
+    title = models.CharField(max_length=255, blank=True, null=True)
+    description = models.TextField(blank=True, null=True)
+    visibility = models.CharField(max_length=32, blank=True, null=True)
+    category_id = models.CharField(max_length=8, blank=True, null=True)
+    made_for_kids = models.BooleanField(default=False)
+    total_bytes = models.BigIntegerField(default=0)
+    # Last byte offset acknowledged by YouTube for the resumable session
+    uploaded_bytes = models.BigIntegerField(default=0)
+    upload_uri = models.TextField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    video_id = models.CharField(max_length=64, blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "created_at"])]
+
+    def __str__(self):
+        return f"{self.title} ({self.status})"
+
+
+class YouTubeVideo(models.Model):
+    """
+    Local copy of a video uploaded to a user's channel
+    """
+
+    user = models.ForeignKey(UserAccount, on_delete=models.CASCADE)
+    video_id = models.CharField(max_length=64)
+    title = models.CharField(max_length=255)
+    description = models.TextField(blank=True)
+    published_at = models.DateTimeField()
+    like_count = models.BigIntegerField(default=0)
+    comment_count = models.BigIntegerField(default=0)
+    view_count = models.BigIntegerField(default=0)
+    statistics_updated_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "video_id"], name="unique_user_video"),
+        ]
+        indexes = [models.Index(fields=["user", "-published_at"])]
+
+    def __str__(self):
+        return self.title
+
+    # Column behind every field of to_dict()
+    FIELD_COLUMNS = {
+        "id": "video_id",
+        "link": "video_id",
+        "title": "title",
+        "description": "description",
+        "published_at": "published_at",
+        "like_count": "like_count",
+        "comment_count": "comment_count",
+        "view_count": "view_count",
+    }
+
+    def to_dict(self, fields=None):
+        """
+        Return the given fields of the video the way the API lists it,
+        reading only their columns
+        """
+        video = {}
+        for field in fields or self.FIELD_COLUMNS:
+            if field == "link":
+                video[field] = f"https://www.youtube.com/watch?v={self.video_id}"
+            elif field == "published_at":
+                video[field] = self.published_at.isoformat().replace("+00:00", "Z")
+            else:
+                video[field] = getattr(self, self.FIELD_COLUMNS[field])
+        return video
+
+
+class ChannelSync(models.Model):
+    """
+    Tracks when the videos of a user's channel were last synced
+    """
+
+    user = models.OneToOneField(UserAccount, on_delete=models.CASCADE)
+    uploads_playlist_id = models.CharField(max_length=64, blank=True)
+    synced_at = models.DateTimeField(blank=True, null=True)
+    statistics_refreshed_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.user} ({self.synced_at})"
+
+
+class VideoStatistics(models.Model):
+    """
+    Snapshot of the counts of a stored video at a point in time
+    """
+
+    video = models.ForeignKey(
+        YouTubeVideo, on_delete=models.CASCADE, related_name="statistics"
+    )
+    like_count = models.BigIntegerField(default=0)
+    comment_count = models.BigIntegerField(default=0)
+    view_count = models.BigIntegerField(default=0)
+    captured_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=["video", "-captured_at"])]
+
+    def __str__(self):
+        return f"{self.video} ({self.captured_at})"
+
+
+class QuotaUsage(models.Model):
+    """
+    YouTube Data API quota units spent by a user on one method in one
+    quota day
+    """
+
+    user = models.ForeignKey(UserAccount, on_delete=models.CASCADE)
+    day = models.DateField()
+    method = models.CharField(max_length=64)
+    calls = models.PositiveIntegerField(default=0)
+    units = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "day", "method"], name="unique_quota_usage"
+            ),
+        ]
+        indexes = [models.Index(fields=["day"])]
+
+    def __str__(self):
+        return f"{self.user} {self.method} {self.day}: {self.units}"
+
+
+class QuotaDay(models.Model):
+    """
+    YouTube Data API quota units spent by everyone in one quota day
+    """
+
+    day = models.DateField(unique=True)
+    units = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.day}: {self.units}"
+
+
+class QuotaBucket(models.Model):
+    """
+    Token bucket limiting how fast a user spends quota units
+    """
+
+    user = models.OneToOneField(UserAccount, on_delete=models.CASCADE)
+    tokens = models.FloatField()
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user}: {self.tokens:.0f}"
@@ -0,0 +1,72 @@
+"""
+OAuth client configuration of the YouTube integration, loaded once per
+process and reloaded on SIGHUP
+"""
+
+import json
+import logging
+import signal
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from google_auth_oauthlib.flow import Flow
+
+logger = logging.getLogger(__name__)
+
+_client_config = None
+
+
+def load_client_config():
+    """
+    Read the client secrets file, keeping the current configuration if
+    it cannot be read
+    """
+    global _client_config
+    try:
+        with open(settings.YOUTUBE_CLIENT_SECRETS_FILE, encoding="utf-8") as secrets_file:
+            _client_config = json.load(secrets_file)
+    except (OSError, ValueError) as exception:
+        logger.warning("Could not load the YouTube client configuration: %s", exception)
+    return _client_config
+
+
+def get_client_config():
+    """
+    Return the loaded client configuration
+    """
+    if _client_config is None and load_client_config() is None:
+        raise ImproperlyConfigured(
+            f"No YouTube client configuration in {settings.YOUTUBE_CLIENT_SECRETS_FILE}"
+        )
+    return _client_config
+
+
+def create_flow(state=None):
+    """
+    Return an authorization flow for the configured scopes and redirect URI
+    """
+    return Flow.from_client_config(
+        get_client_config(),
+        scopes=settings.YOUTUBE_OAUTH_SCOPES,
+        state=state,
+        redirect_uri=settings.YOUTUBE_OAUTH_REDIRECT_URI,
+    )
+
+
+def install_reload_handler():
+    """
+    Reload the client configuration when the process receives SIGHUP,
+    calling any handler that was installed before
+    """
+    # Signal handlers can only be installed from the main thread
+    if not hasattr(signal, "SIGHUP") or threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGHUP)
+
+    def reload_client_config(signum, frame):
+        load_client_config()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGHUP, reload_client_config)
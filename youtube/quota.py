@@ -0,0 +1,193 @@
+"""
+YouTube Data API quota accounting and per-user rate limiting
+"""
+
+import datetime
+import math
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from rest_framework.exceptions import Throttled
+
+from .models import QuotaBucket, QuotaDay, QuotaUsage
+
+# Unit cost of the methods we call, everything else costs DEFAULT_COST
+# https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {
+    "youtube.search.list": 100,
+    "youtube.videos.insert": 1600,
+    "youtube.videos.update": 50,
+    "youtube.videos.delete": 50,
+    "youtube.videos.rate": 50,
+}
+DEFAULT_COST = 1
+
+# YouTube resets quotas at midnight Pacific Time
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+
+
+class QuotaExceeded(Throttled):
+    """
+    Raised instead of making a call that would exceed the quota
+    """
+
+    default_detail = "YouTube quota exhausted."
+
+
+def get_cost(method):
+    """
+    Return the quota units spent by one call to the given method
+    """
+    return QUOTA_COSTS.get(method, DEFAULT_COST)
+
+
+def get_quota_day(now=None):
+    """
+    Return the current quota day
+    """
+    return (now or timezone.now()).astimezone(QUOTA_TIMEZONE).date()
+
+
+def seconds_until_reset(now=None):
+    """
+    Return the number of seconds until the quota day ends
+    """
+    now = (now or timezone.now()).astimezone(QUOTA_TIMEZONE)
+    tomorrow = datetime.datetime.combine(
+        now.date() + datetime.timedelta(days=1), datetime.time(), QUOTA_TIMEZONE
+    )
+    return (tomorrow - now).total_seconds()
+
+
+def get_refill_rate():
+    """
+    Return how many units a user's bucket regains per second
+    """
+    return settings.YOUTUBE_QUOTA_USER_DAILY_LIMIT / 86400
+
+
+def get_bucket_tokens(bucket, now):
+    """
+    Return the tokens of the given bucket refilled up to now
+    """
+    elapsed = max(0.0, (now - bucket.updated_at).total_seconds())
+    return min(
+        settings.YOUTUBE_QUOTA_USER_DAILY_LIMIT,
+        bucket.tokens + elapsed * get_refill_rate(),
+    )
+
+
+def get_used_units(day):
+    """
+    Return the units spent by everyone on the given day
+    """
+    return QuotaDay.objects.filter(day=day).values_list("units", flat=True).first() or 0
+
+
+def spend_daily_units(units, day):
+    """
+    Add units to the day's total unless it would go over the project's
+    daily budget, and return whether they were added
+    """
+    # The conditional increment locks the row until the caller's
+    # transaction ends, concurrent workers cannot both take the last units
+    total = QuotaDay.objects.filter(
+        day=day, units__lte=settings.YOUTUBE_QUOTA_DAILY_LIMIT - units
+    )
+    if total.update(units=F("units") + units):
+        return True
+    if units > settings.YOUTUBE_QUOTA_DAILY_LIMIT or QuotaDay.objects.filter(day=day).exists():
+        return False
+    try:
+        with transaction.atomic():
+            QuotaDay.objects.create(day=day, units=units)
+        return True
+    except IntegrityError:
+        # Another worker started the day first
+        return bool(total.update(units=F("units") + units))
+
+
+def record_usage(user, method, units, day):
+    """
+    Add one call of the given method to the ledger
+    """
+    usage = QuotaUsage.objects.filter(user=user, day=day, method=method)
+    if usage.update(calls=F("calls") + 1, units=F("units") + units):
+        return
+    try:
+        with transaction.atomic():
+            QuotaUsage.objects.create(
+                user=user, day=day, method=method, calls=1, units=units
+            )
+    except IntegrityError:
+        # Another worker created the row first
+        usage.update(calls=F("calls") + 1, units=F("units") + units)
+
+
+def consume_quota(user, method):
+    """
+    Take the cost of one call to the given method from the user's bucket
+    and the project's daily budget, raising QuotaExceeded if either
+    cannot afford it
+    """
+    units = get_cost(method)
+    now = timezone.now()
+    day = get_quota_day(now)
+    with transaction.atomic():
+        bucket, _ = QuotaBucket.objects.select_for_update().get_or_create(
+            user=user,
+            defaults={"tokens": settings.YOUTUBE_QUOTA_USER_DAILY_LIMIT, "updated_at": now},
+        )
+        tokens = get_bucket_tokens(bucket, now)
+        if tokens < units:
+            raise QuotaExceeded(wait=math.ceil((units - tokens) / get_refill_rate()))
+        if not spend_daily_units(units, day):
+            raise QuotaExceeded(wait=math.ceil(seconds_until_reset(now)))
+
+        bucket.tokens = tokens - units
+        bucket.updated_at = now
+        bucket.save(update_fields=["tokens", "updated_at"])
+        record_usage(user, method, units, day)
+
+
+def get_quota_report(limit=20):
+    """
+    Summarise today's quota usage for staff
+    """
+    now = timezone.now()
+    day = get_quota_day(now)
+    used = get_used_units(day)
+    top_users = (
+        QuotaUsage.objects.filter(day=day)
+        .values("user")
+        .annotate(units=Sum("units"))
+        .order_by("-units")[:limit]
+    )
+    buckets = {
+        bucket.user_id: bucket
+        for bucket in QuotaBucket.objects.filter(
+            user__in=[usage["user"] for usage in top_users]
+        )
+    }
+    return {
+        "day": day.isoformat(),
+        "daily_limit": settings.YOUTUBE_QUOTA_DAILY_LIMIT,
+        "used": used,
+        "remaining": max(0, settings.YOUTUBE_QUOTA_DAILY_LIMIT - used),
+        "resets_in": math.ceil(seconds_until_reset(now)),
+        "users": [
+            {
+                "user_id": usage["user"],
+                "used": usage["units"],
+                "bucket_tokens": (
+                    int(get_bucket_tokens(buckets[usage["user"]], now))
+                    if usage["user"] in buckets
+                    else settings.YOUTUBE_QUOTA_USER_DAILY_LIMIT
+                ),
+            }
+            for usage in top_users
+        ],
+    }
@@ -0,0 +1,227 @@
+"""
+Synchronisation of a user's uploaded videos into the local store
+"""
+
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .client import build_youtube
+from .models import ChannelSync, VideoStatistics, YouTubeCredentials, YouTubeVideo
+from .videos import (
+    MAX_RESULTS,
+    get_uploads_playlist_id,
+    get_video_statistics,
+    iter_pages,
+    list_uploaded_videos,
+)
+
+VIDEO_FIELDS = [
+    "title",
+    "description",
+    "published_at",
+    "like_count",
+    "comment_count",
+    "view_count",
+]
+
+# Shared by every fetch_batches call, so its threads keep their keep-alive
+# transports instead of opening new connections to Google on every request
+fetch_executor = ThreadPoolExecutor(
+    max_workers=settings.YOUTUBE_FETCH_WORKERS, thread_name_prefix="youtube-fetch"
+)
+
+
+def save_videos(user, videos):
+    """
+    Insert or update the given videos in the local store
+    """
+    YouTubeVideo.objects.bulk_create(
+        [
+            YouTubeVideo(
+                user=user,
+                video_id=video["id"],
+                title=video["title"],
+                description=video["description"],
+                published_at=parse_datetime(video["published_at"]),
+                like_count=video["like_count"],
+                comment_count=video["comment_count"],
+                view_count=video["view_count"],
+            )
+            for video in videos
+        ],
+        update_conflicts=True,
+        unique_fields=["user", "video_id"],
+        update_fields=VIDEO_FIELDS,
+    )
+
+
+def sync_uploaded_videos(user, youtube, full=False):
+    """
+    Pull the videos published since the last sync into the local store,
+    or the whole channel with full=True or until a walk has completed,
+    and return how many were saved
+    """
+    channel_sync, _ = ChannelSync.objects.get_or_create(user=user)
+    # An interrupted first walk stored the newest videos only, stopping at
+    # them next time would leave the older ones out for good
+    full = full or channel_sync.synced_at is None
+    if not channel_sync.uploads_playlist_id:
+        channel_sync.uploads_playlist_id = get_uploads_playlist_id(youtube)
+
+    latest = None
+    if not full:
+        latest = YouTubeVideo.objects.filter(user=user).aggregate(
+            latest=Max("published_at")
+        )["latest"]
+
+    # The uploads playlist lists the newest videos first, so the walk stops
+    # at the first page reaching videos that are already stored
+    saved = 0
+    seen = set()
+    pages = iter_pages(
+        partial(list_uploaded_videos, youtube, channel_sync.uploads_playlist_id)
+    )
+    for videos in pages:
+        new_videos = [
+            video
+            for video in videos
+            if latest is None or parse_datetime(video["published_at"]) > latest
+        ]
+        save_videos(user, new_videos)
+        saved += len(new_videos)
+        seen.update(video["id"] for video in videos)
+        if len(new_videos) < len(videos):
+            break
+
+    if full:
+        # Forget the videos that were deleted from the channel
+        YouTubeVideo.objects.filter(user=user).exclude(video_id__in=seen).delete()
+
+    channel_sync.synced_at = timezone.now()
+    channel_sync.save()
+    return saved
+
+
+def fetch_batches(user, credentials, video_ids, fetch, max_workers):
+    """
+    Call fetch(youtube, batch) on MAX_RESULTS id batches of the given
+    videos, running at most max_workers batches at a time on
+    fetch_executor, and merge the dicts it returns
+    """
+    batches = [
+        video_ids[start:start + MAX_RESULTS]
+        for start in range(0, len(video_ids), MAX_RESULTS)
+    ]
+    # API clients are not thread-safe, every thread builds its own
+    local = threading.local()
+
+    def fetch_batch(batch):
+        try:
+            if not hasattr(local, "youtube"):
+                local.youtube = build_youtube(credentials, user)
+            return fetch(local.youtube, batch)
+        finally:
+            # Charging the quota opened a database connection in this thread
+            connection.close()
+
+    merged = {}
+    pending = set()
+    try:
+        for batch in batches:
+            if len(pending) >= max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    merged.update(future.result())
+            pending.add(fetch_executor.submit(fetch_batch, batch))
+        for future in wait(pending).done:
+            merged.update(future.result())
+    finally:
+        for future in pending:
+            future.cancel()
+    return merged
+
+
+def fetch_statistics(user, credentials, video_ids, max_workers):
+    """
+    Fetch the statistics of the given videos in MAX_RESULTS id batches,
+    running at most max_workers batches at a time
+    """
+    return fetch_batches(user, credentials, video_ids, get_video_statistics, max_workers)
+
+
+def refresh_video_statistics(user, credentials, max_workers=4):
+    """
+    Update the counts of every stored video of the given user, keeping a
+    snapshot of the ones that changed, and return how many changed
+    """
+    videos = list(
+        YouTubeVideo.objects.filter(user=user).only(
+            "pk", "video_id", "like_count", "comment_count", "view_count"
+        )
+    )
+    statistics_by_id = fetch_statistics(
+        user, credentials, [video.video_id for video in videos], max_workers
+    )
+
+    now = timezone.now()
+    changed = []
+    snapshots = []
+    for video in videos:
+        statistics = statistics_by_id.get(video.video_id)
+        if statistics is None:
+            continue
+        counts = (
+            int(statistics.get("likeCount", 0)),
+            int(statistics.get("commentCount", 0)),
+            int(statistics.get("viewCount", 0)),
+        )
+        if counts != (video.like_count, video.comment_count, video.view_count):
+            video.like_count, video.comment_count, video.view_count = counts
+            changed.append(video)
+            snapshots.append(VideoStatistics(
+                video=video,
+                like_count=video.like_count,
+                comment_count=video.comment_count,
+                view_count=video.view_count,
+                captured_at=now,
+            ))
+
+    # Only the changed rows are rewritten, the others just get the timestamp
+    YouTubeVideo.objects.bulk_update(
+        changed, ["like_count", "comment_count", "view_count"], batch_size=500
+    )
+    YouTubeVideo.objects.filter(user=user).update(statistics_updated_at=now)
+    VideoStatistics.objects.bulk_create(snapshots, batch_size=500)
+    ChannelSync.objects.filter(user=user).update(statistics_refreshed_at=now)
+    return len(snapshots)
+
+
+def get_stale_channels(hot_after, idle_after, hot_window):
+    """
+    Return the synced channels whose statistics are older than hot_after
+    if they published a video within hot_window, or idle_after otherwise
+    """
+    now = timezone.now()
+    channels = (
+        ChannelSync.objects.filter(
+            user__in=YouTubeCredentials.objects.values("user"),
+            synced_at__isnull=False,
+        )
+        .annotate(latest=Max("user__youtubevideo__published_at"))
+        .select_related("user")
+    )
+    stale = []
+    for channel in channels:
+        is_hot = channel.latest is not None and channel.latest >= now - hot_window
+        threshold = hot_after if is_hot else idle_after
+        refreshed_at = channel.statistics_refreshed_at
+        if refreshed_at is None or refreshed_at <= now - threshold:
+            stale.append(channel)
+    return stale
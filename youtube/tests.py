@@ -1,3 +1,1590 @@
-from django.test import TestCase
+import datetime
+import gzip
+import io
+import json
+import os
+import shutil
+import signal
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import timeit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import reverse
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.errors import HttpError
+import requests
+from googleapiclient.http import HttpMockSequence, MediaUploadProgress, build_http
+from rest_framework.test import APIClient
+
+from authentication.models import UserAccount
+from . import oauth, uploads
+from .client import build_youtube, get_discovery_document
+from .credentials import clear_credentials_cache, get_credentials
+from .execution import YouTubeUnavailable, breaker
+from .models import (
+    ChannelSync,
+    OAuthState,
+    QuotaBucket,
+    QuotaDay,
+    QuotaUsage,
+    UploadJob,
+    VideoStatistics,
+    YouTubeCredentials,
+    YouTubeVideo,
+)
+from .quota import QuotaExceeded
+from .sync import fetch_batches
+from .transport import TransportPool, create_http
+from .uploads import claim_next_job, store_video
+
+CREDENTIALS = {
+    "token": "access-token",
+    "refresh_token": "refresh-token",
+    "client_id": "client-id",
+    "client_secret": "client-secret",
+    "token_uri": "https://oauth2.googleapis.com/token",
+    "expiry": "2099-01-01T00:00:00Z",
+}
+
+
+class FakeRequest:
+    """
+    Stands in for a googleapiclient HttpRequest
+    """
+
+    resumable_uri = "https://upload.example.com/session"
+
+    def __init__(self, client, name, kwargs):
+        self.client = client
+        self.name = name
+        self.kwargs = kwargs
+
+    def execute(self):
+        self.client.calls.append((self.name, self.kwargs))
+        return self.client.handlers[self.name](**self.kwargs)
+
+    def next_chunk(self):
+        return self.execute()
+
+
+class FakeResource:
+    """
+    Stands in for a googleapiclient Resource collection
+    """
+
+    def __init__(self, client, resource):
+        self.client = client
+        self.resource = resource
+
+    def __getattr__(self, method):
+        name = f"{self.resource}.{method}"
+        return lambda **kwargs: FakeRequest(self.client, name, kwargs)
+
+
+class FakeYouTube:
+    """
+    Stubbed YouTube Data API client recording every outbound call
+    """
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.calls = []
+
+    def __getattr__(self, resource):
+        return lambda: FakeResource(self, resource)
+
+    def count(self, name):
+        return len([call for call in self.calls if call[0] == name])
+
+
+def make_channel(video_count, page_size=50):
+    """
+    Return handlers serving a channel with the given number of uploads,
+    video0 being the oldest one
+    """
+    video_ids = [f"video{index}" for index in reversed(range(video_count))]
+
+    def channels_list(**kwargs):
+        return {
+            "items": [
+                {"contentDetails": {"relatedPlaylists": {"uploads": "UUchannel"}}}
+            ]
+        }
+
+    def playlist_items_list(**kwargs):
+        start = int(kwargs.get("pageToken") or 0)
+        end = start + page_size
+        page = {
+            "items": [
+                {
+                    "snippet": {
+                        "title": f"Title {video_id}",
+                        "description": "",
+                        "publishedAt": (
+                            datetime.datetime(2023, 1, 1)
+                            + datetime.timedelta(minutes=int(video_id[5:]))
+                        ).isoformat() + "Z",
+                        "resourceId": {"videoId": video_id},
+                    }
+                }
+                for video_id in video_ids[start:end]
+            ]
+        }
+        if end < len(video_ids):
+            page["nextPageToken"] = str(end)
+        return page
+
+    def videos_list(**kwargs):
+        ids = kwargs["id"].split(",")
+        assert len(ids) <= 50
+        return {
+            "items": [
+                {"id": video_id, "statistics": {"viewCount": "3", "likeCount": "2"}}
+                for video_id in ids
+            ]
+        }
+
+    return {
+        "channels.list": channels_list,
+        "playlistItems.list": playlist_items_list,
+        "videos.list": videos_list,
+    }
+
+
+def make_liked(video_count, page_size=50):
+    """
+    Return handlers serving the given number of liked videos
+    """
+
+    def videos_list(**kwargs):
+        start = int(kwargs.get("pageToken") or 0)
+        end = min(start + page_size, video_count)
+        page = {
+            "items": [
+                {
+                    "id": f"liked{index}",
+                    "snippet": {"title": f"Liked {index}", "description": ""},
+                    "statistics": {"viewCount": "5"},
+                }
+                for index in range(start, end)
+            ]
+        }
+        if end < video_count:
+            page["nextPageToken"] = str(end)
+        return page
+
+    return {"videos.list": videos_list}
+
+
+class FakeUploadTarget:
+    """
+    Fake videos.insert handler receiving a resumable upload chunk by chunk
+    """
+
+    def __init__(self):
+        self.received = b""
+
+    def __call__(self, media_body, **kwargs):
+        self.received += media_body.getbytes(len(self.received), media_body.chunksize())
+        if len(self.received) >= media_body.size():
+            return None, {"id": "uploaded-video"}
+        return MediaUploadProgress(len(self.received), media_body.size()), None
+
+
+class StandInUploadHandler(BaseHTTPRequestHandler):
+    """
+    Speaks enough of the YouTube resumable upload protocol for the worker
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def send_progress(self):
+        self.send_response(308)
+        if self.server.received:
+            self.send_header("Range", f"bytes=0-{len(self.server.received) - 1}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        self.server.metadata = json.loads(self.read_body() or "{}")
+        self.server.sessions += 1
+        self.send_response(200)
+        self.send_header("Location", f"{self.server.url}/session/{self.server.sessions}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_PUT(self):
+        body = self.read_body()
+        content_range = self.headers["Content-Range"]
+        total = content_range.rsplit("/", 1)[1]
+        total = None if total == "*" else int(total)
+        if content_range.startswith("bytes */") and len(self.server.received) != total:
+            self.send_progress()
+            return
+
+        self.server.put_bytes += len(body)
+        self.server.chunks += 1
+        if self.server.chunks in self.server.fail_chunks:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if body:
+            start = int(content_range.split(" ")[1].split("-")[0])
+            if self.server.chunks in self.server.partial_chunks:
+                body = body[:len(body) // 2]
+            self.server.received += body[len(self.server.received) - start:]
+        if total is None or len(self.server.received) < total:
+            self.send_progress()
+            return
+
+        content = json.dumps({"id": "stand-in-video"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class StandInUploadServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the YouTube upload endpoint
+    """
+
+    def __init__(self, fail_chunks=(), partial_chunks=()):
+        super().__init__(("127.0.0.1", 0), StandInUploadHandler)
+        self.url = f"http://127.0.0.1:{self.server_port}"
+        self.fail_chunks = set(fail_chunks)
+        # Chunks of which only the first half is stored
+        self.partial_chunks = set(partial_chunks)
+        self.received = b""
+        self.put_bytes = 0
+        self.chunks = 0
+        self.sessions = 0
+
+    def build_youtube(self, credentials, user=None):
+        document = dict(get_discovery_document(), rootUrl=self.url + "/")
+        return build_from_document(document, http=build_http())
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class WorkerKilled(BaseException):
+    """
+    Simulates the worker process dying mid-upload
+    """
+
+
+class YouTubeTestCase(TestCase):
+    """
+    Base test case with a user who has connected their YouTube account
+    """
+
+    def setUp(self):
+        clear_credentials_cache()
+        self.addCleanup(clear_credentials_cache)
+        breaker.reset()
+        self.addCleanup(breaker.reset)
+        self.user = UserAccount.objects.create_user(
+            email="user@example.com", password="password", username="user"
+        )
+        self.stored_credentials = YouTubeCredentials.objects.create(
+            user=self.user, credentials=json.dumps(CREDENTIALS)
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+
+class UploadedVideosTests(YouTubeTestCase):
+    def test_one_statistics_call_per_page(self):
+        youtube = FakeYouTube(make_channel(120))
+        with mock.patch("youtube.views.build_youtube", return_value=youtube):
+            response = self.client.get(
+                reverse("youtube:get_uploaded_videos"), {"all": "true"}
+            )
+
+        videos = response.json()["videos"]
+        self.assertEqual(len(videos), 120)
+        self.assertEqual([video["id"] for video in videos][:2], ["video119", "video118"])
+        self.assertEqual(videos[-1]["view_count"], 3)
+        self.assertEqual(youtube.count("channels.list"), 1)
+        self.assertEqual(youtube.count("playlistItems.list"), 3)
+        self.assertEqual(youtube.count("videos.list"), 3)
+        self.assertEqual(youtube.count("search.list"), 0)
+
+    def test_fields_prune_stored_videos(self):
+        with mock.patch("youtube.views.build_youtube", return_value=FakeYouTube(make_channel(2))):
+            first = self.client.get(
+                reverse("youtube:get_uploaded_videos"), {"fields": "title", "page_size": 1}
+            ).json()
+        second = self.client.get(reverse("youtube:get_uploaded_videos"), {
+            "fields": "title", "page_size": 1, "page_token": first["next_cursor"],
+        }).json()
+        self.assertEqual(first["videos"], [{"title": "Title video1"}])
+        self.assertEqual(second["videos"], [{"title": "Title video0"}])
+
+    def test_missing_statistics_default_to_zero(self):
+        handlers = make_channel(2)
+        handlers["videos.list"] = lambda **kwargs: {"items": []}
+        youtube = FakeYouTube(handlers)
+        with mock.patch("youtube.views.build_youtube", return_value=youtube):
+            response = self.client.get(reverse("youtube:get_uploaded_videos"))
+
+        self.assertEqual(response.json()["videos"][0]["like_count"], 0)
+
+    def test_listing_is_served_from_the_store(self):
+        youtube = FakeYouTube(make_channel(10))
+        url = reverse("youtube:get_uploaded_videos")
+        with mock.patch("youtube.views.build_youtube", return_value=youtube):
+            self.client.get(url)
+            calls = len(youtube.calls)
+            response = self.client.get(url)
+
+        self.assertEqual(len(youtube.calls), calls)
+        self.assertEqual(len(response.json()["videos"]), 10)
+
+    def test_refresh_only_pulls_new_videos(self):
+        url = reverse("youtube:get_uploaded_videos")
+        with mock.patch("youtube.views.build_youtube", return_value=FakeYouTube(make_channel(120))):
+            self.client.get(url)
+
+        youtube = FakeYouTube(make_channel(125))
+        with mock.patch("youtube.views.build_youtube", return_value=youtube):
+            response = self.client.get(url, {"refresh": "true", "all": "true"})
+
+        videos = response.json()["videos"]
+        self.assertEqual(len(videos), 125)
+        self.assertEqual(videos[0]["id"], "video124")
+        # The uploads playlist is remembered and only the first page is read
+        self.assertEqual(youtube.count("channels.list"), 0)
+        self.assertEqual(youtube.count("playlistItems.list"), 1)
+        self.assertEqual(YouTubeVideo.objects.filter(user=self.user).count(), 125)
+
+    def test_interrupted_first_sync_is_resumed(self):
+        url = reverse("youtube:get_uploaded_videos")
+        handlers = make_channel(120)
+        list_page = handlers["playlistItems.list"]
+
+        def fail_on_second_page(**kwargs):
+            if kwargs.get("pageToken"):
+                raise YouTubeUnavailable()
+            return list_page(**kwargs)
+
+        handlers["playlistItems.list"] = fail_on_second_page
+        with mock.patch("youtube.views.build_youtube", return_value=FakeYouTube(handlers)):
+            self.assertEqual(self.client.get(url).status_code, 503)
+        self.assertEqual(YouTubeVideo.objects.filter(user=self.user).count(), 50)
+
+        with mock.patch("youtube.views.build_youtube", return_value=FakeYouTube(make_channel(120))):
+            response = self.client.get(url, {"refresh": "true", "all": "true"})
+        self.assertEqual(len(response.json()["videos"]), 120)
+
+    def test_full_refresh_forgets_deleted_videos(self):
+        url = reverse("youtube:get_uploaded_videos")
+        with mock.patch("youtube.views.build_youtube", return_value=FakeYouTube(make_channel(5))):
+            self.client.get(url)
+        YouTubeVideo.objects.filter(video_id="video4").update(video_id="deleted")
+
+        with mock.patch("youtube.views.build_youtube", return_value=FakeYouTube(make_channel(5))):
+            response = self.client.get(url, {"refresh": "full", "all": "true"})
+
+        ids = [video["id"] for video in response.json()["videos"]]
+        self.assertEqual(ids, ["video4", "video3", "video2", "video1", "video0"])
+
+    def test_cursor_pagination(self):
+        youtube = FakeYouTube(make_channel(70))
+        url = reverse("youtube:get_uploaded_videos")
+        with mock.patch("youtube.views.build_youtube", return_value=youtube):
+            first = self.client.get(url, {"page_size": 30}).json()
+            second = self.client.get(
+                url, {"page_size": 30, "page_token": first["next_cursor"]}
+            ).json()
+            third = self.client.get(
+                url, {"page_size": 30, "page_token": second["next_cursor"]}
+            ).json()
+
+        self.assertEqual(len(first["videos"]), 30)
+        self.assertEqual(second["videos"][0]["id"], "video39")
+        self.assertEqual(len(third["videos"]), 10)
+        self.assertIsNone(third["next_cursor"])
+
+    def test_json_stream_matches_all_mode(self):
+        youtube = FakeYouTube(make_channel(60))
+        url = reverse("youtube:get_uploaded_videos")
+        with mock.patch("youtube.views.build_youtube", return_value=youtube):
+            streamed = self.client.get(url, {"stream": "json"})
+            streamed = json.loads(b"".join(streamed.streaming_content))
+            buffered = self.client.get(url, {"all": "true"}).json()
+
+        self.assertEqual(streamed, buffered)
+
+    def test_unknown_stream_format(self):
+        for value in ("csv", "1"):
+            for url in (
+                reverse("youtube:get_uploaded_videos"), reverse("youtube:liked_videos")
+            ):
+                response = self.client.get(url, {"stream": value})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("ndjson", response.json()["error"])
+
+    def test_invalid_cursor(self):
+        youtube = FakeYouTube(make_channel(1))
+        with mock.patch("youtube.views.build_youtube", return_value=youtube):
+            response = self.client.get(
+                reverse("youtube:get_uploaded_videos"), {"page_token": "garbage"}
+            )
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTests(YouTubeTestCase):
+    def setUp(self):
+        super().setUp()
+        with mock.patch("youtube.views.build_youtube", return_value=FakeYouTube(make_channel(120))):
+            self.response = self.client.get(reverse("youtube:get_uploaded_videos"))
+
+    def test_unchanged_store_answers_304_without_reading_videos(self):
+        etag = self.response["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse("youtube:get_uploaded_videos"), HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertFalse(any(
+            "youtube_youtubevideo" in query["sql"] for query in queries.captured_queries
+        ))
+
+    def test_changed_store_or_parameters_answer_200(self):
+        etag = self.response["ETag"]
+        response = self.client.get(
+            reverse("youtube:get_uploaded_videos"), {"fields": "id"}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+
+        ChannelSync.objects.update(statistics_refreshed_at=timezone.now())
+        response = self.client.get(
+            reverse("youtube:get_uploaded_videos"), HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_live_listing_answers_304_on_same_content(self):
+        with mock.patch("youtube.views.build_youtube", return_value=FakeYouTube(make_liked(3))):
+            etag = self.client.get(reverse("youtube:liked_videos"))["ETag"]
+            response = self.client.get(reverse("youtube:liked_videos"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_large_responses_are_compressed(self):
+        response = self.client.get(
+            reverse("youtube:get_uploaded_videos"), {"all": "true"}, HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        videos = json.loads(gzip.decompress(response.content))["videos"]
+        self.assertEqual(len(videos), 120)
+
+        response = self.client.get(
+            reverse("youtube:get_uploaded_videos"), {"page_size": 1}, HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+
+class LikedVideosTests(YouTubeTestCase):
+    def test_ndjson_stream_fetches_pages_lazily(self):
+        youtube = FakeYouTube(make_liked(120))
+        with mock.patch("youtube.views.build_youtube", return_value=youtube):
+            response = self.client.get(
+                reverse("youtube:liked_videos"), {"stream": "ndjson"}
+            )
+            self.assertEqual(response["Content-Type"], "application/x-ndjson")
+            self.assertEqual(youtube.count("videos.list"), 0)
+            chunks = list(response.streaming_content)
+
+        self.assertEqual(len(chunks), 3)
+        lines = b"".join(chunks).decode().splitlines()
+        self.assertEqual(len(lines), 120)
+        self.assertEqual(json.loads(lines[0])["id"], "liked0")
+
+    def test_fields_select_a_partial_response(self):
+        youtube = FakeYouTube(make_liked(3))
+        with mock.patch("youtube.views.build_youtube", return_value=youtube):
+            response = self.client.get(
+                reverse("youtube:liked_videos"), {"fields": "title,views"}
+            )
+
+        kwargs = youtube.calls[0][1]
+        self.assertEqual(kwargs["part"], "snippet,statistics")
+        self.assertEqual(
+            kwargs["fields"], "items(id,snippet(title),statistics(viewCount)),nextPageToken"
+        )
+        self.assertEqual(response.json()["videos"][0], {"title": "Liked 0", "views": "5"})
+
+    def test_id_fields_need_no_snippet(self):
+        youtube = FakeYouTube(make_liked(1))
+        with mock.patch("youtube.views.build_youtube", return_value=youtube):
+            response = self.client.get(reverse("youtube:liked_videos"), {"fields": "link"})
+        self.assertEqual(youtube.calls[0][1]["part"], "id")
+        self.assertEqual(
+            response.json()["videos"], [{"link": "https://www.youtube.com/watch?v=liked0"}]
+        )
+
+    def test_unknown_field(self):
+        response = self.client.get(reverse("youtube:liked_videos"), {"fields": "title,tags"})
+        self.assertEqual(response.status_code, 400)
+
+
+class StatisticsRefreshTests(YouTubeTestCase):
+    def setUp(self):
+        super().setUp()
+        youtube = FakeYouTube(make_channel(120))
+        with mock.patch("youtube.views.build_youtube", return_value=youtube):
+            self.client.get(reverse("youtube:get_uploaded_videos"))
+
+    def refresh(self, *args, view_count="10"):
+        handlers = make_channel(0)
+        handlers["videos.list"] = lambda **kwargs: {
+            "items": [
+                {"id": video_id, "statistics": {"viewCount": view_count}}
+                for video_id in kwargs["id"].split(",")
+            ]
+        }
+        youtube = FakeYouTube(handlers)
+        with mock.patch("youtube.sync.build_youtube", return_value=youtube):
+            call_command("refresh_video_statistics", *args, stdout=io.StringIO())
+        return youtube
+
+    def test_statistics_are_refreshed_in_batches(self):
+        youtube = self.refresh()
+
+        self.assertEqual(youtube.count("videos.list"), 3)
+        self.assertFalse(YouTubeVideo.objects.exclude(view_count=10).exists())
+        self.assertEqual(VideoStatistics.objects.count(), 120)
+        self.assertIsNotNone(ChannelSync.objects.get().statistics_refreshed_at)
+
+    def test_fresh_statistics_are_left_alone(self):
+        self.refresh()
+        refreshed = timezone.now()
+        self.assertEqual(self.refresh().count("videos.list"), 0)
+
+        # Unchanged counts don't add snapshots nor rewrite the videos
+        with CaptureQueriesContext(connection) as queries:
+            self.refresh("--idle-after", "0")
+        self.assertEqual(VideoStatistics.objects.count(), 120)
+        updates = [
+            query["sql"] for query in queries
+            if query["sql"].startswith('UPDATE "youtube_youtubevideo"')
+        ]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"statistics_updated_at"', updates[0])
+        self.assertNotIn("CASE", updates[0])
+        self.assertFalse(
+            YouTubeVideo.objects.exclude(statistics_updated_at__gte=refreshed).exists()
+        )
+
+    def test_hot_channels_refresh_sooner(self):
+        self.refresh()
+        ChannelSync.objects.update(
+            statistics_refreshed_at=timezone.now() - datetime.timedelta(minutes=30)
+        )
+        self.assertEqual(self.refresh().count("videos.list"), 0)
+
+        YouTubeVideo.objects.filter(video_id="video119").update(published_at=timezone.now())
+        self.assertEqual(self.refresh().count("videos.list"), 3)
+
+
+class BulkVideosTests(YouTubeTestCase):
+    def post(self, video_ids, youtube=None):
+        youtube = youtube or FakeYouTube({"videos.list": lambda **kwargs: {
+            "items": [
+                {
+                    "id": video_id,
+                    "snippet": {
+                        "title": video_id,
+                        "description": "",
+                        "publishedAt": "2023-01-01T00:00:00Z",
+                    },
+                    "statistics": {"viewCount": "7"},
+                }
+                for video_id in kwargs["id"].split(",")
+                if video_id != "deleted"
+            ]
+        }})
+        with mock.patch("youtube.sync.build_youtube", return_value=youtube):
+            response = self.client.post(
+                reverse("youtube:videos_bulk"), {"ids": video_ids}, format="json"
+            )
+        return response, youtube
+
+    def test_stored_videos_skip_the_network(self):
+        with mock.patch("youtube.views.build_youtube", return_value=FakeYouTube(make_channel(2))):
+            self.client.get(reverse("youtube:get_uploaded_videos"))
+        remote_ids = [f"remote{n}" for n in range(120)]
+        video_ids = ["video1", *remote_ids, "deleted", "video0", "remote0"]
+
+        response, youtube = self.post(video_ids)
+
+        self.assertEqual(youtube.count("videos.list"), 3)
+        requested = [
+            video_id for _, kwargs in youtube.calls for video_id in kwargs["id"].split(",")
+        ]
+        self.assertEqual(sorted(requested), sorted([*remote_ids, "deleted"]))
+        data = response.json()
+        self.assertEqual(
+            [video["id"] for video in data["videos"]], ["video1", *remote_ids, "video0"]
+        )
+        self.assertEqual(data["videos"][1]["view_count"], 7)
+        self.assertEqual(data["missing"], ["deleted"])
+
+    def test_all_stored_needs_no_youtube_account(self):
+        with mock.patch("youtube.views.build_youtube", return_value=FakeYouTube(make_channel(1))):
+            self.client.get(reverse("youtube:get_uploaded_videos"))
+        self.stored_credentials.delete()
+        clear_credentials_cache()
+        response, youtube = self.post(["video0"])
+        self.assertEqual(response.json()["videos"][0]["id"], "video0")
+        self.assertEqual(youtube.calls, [])
+
+    def test_fields_prune_stored_and_fetched_videos(self):
+        with mock.patch("youtube.views.build_youtube", return_value=FakeYouTube(make_channel(1))):
+            self.client.get(reverse("youtube:get_uploaded_videos"))
+        youtube = FakeYouTube({"videos.list": lambda **kwargs: {"items": [
+            {"id": "remote", "statistics": {"viewCount": "7"}},
+        ]}})
+        with mock.patch("youtube.sync.build_youtube", return_value=youtube), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse("youtube:videos_bulk") + "?fields=id,view_count",
+                {"ids": ["video0", "remote"]},
+                format="json",
+            )
+
+        self.assertEqual(youtube.calls[0][1]["part"], "statistics")
+        self.assertEqual(response.json()["videos"], [
+            {"id": "video0", "view_count": 3},
+            {"id": "remote", "view_count": 7},
+        ])
+        stored_query = next(
+            query["sql"] for query in queries.captured_queries
+            if "youtube_youtubevideo" in query["sql"]
+        )
+        self.assertNotIn("description", stored_query)
+
+    def test_fields_without_id_load_stored_videos_in_one_query(self):
+        with mock.patch("youtube.views.build_youtube", return_value=FakeYouTube(make_channel(30))):
+            self.client.get(reverse("youtube:get_uploaded_videos"))
+        url = reverse("youtube:videos_bulk") + "?fields=title"
+        video_ids = [f"video{n}" for n in range(30)]
+        with self.assertNumQueries(1):
+            response = self.client.post(url, {"ids": video_ids}, format="json")
+        self.assertEqual(response.json()["videos"][0], {"title": "Title video0"})
+
+    def test_batches_run_on_shared_threads(self):
+        lock = threading.Lock()
+        running = [0]
+        most_running = [0]
+        threads = set()
+
+        def fetch(youtube, batch):
+            with lock:
+                running[0] += 1
+                most_running[0] = max(most_running[0], running[0])
+                threads.add(threading.current_thread().name)
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return {video_id: {} for video_id in batch}
+
+        video_ids = [f"v{n}" for n in range(300)]
+        with mock.patch("youtube.sync.build_youtube"), \
+                mock.patch("youtube.sync.connection") as db_connection:
+            for _ in range(2):
+                self.assertEqual(
+                    len(fetch_batches(self.user, None, video_ids, fetch, 2)), 300
+                )
+
+        # Every batch closes the connection its thread opened
+        self.assertEqual(db_connection.close.call_count, 12)
+        self.assertEqual(most_running[0], 2)
+        self.assertTrue(all(name.startswith("youtube-fetch") for name in threads))
+
+    def test_invalid_ids(self):
+        self.assertEqual(self.post("video0")[0].status_code, 400)
+        self.assertEqual(self.post([1, 2])[0].status_code, 400)
+        self.assertEqual(self.post([f"v{n}" for n in range(501)])[0].status_code, 400)
+
+
+@override_settings(YOUTUBE_QUOTA_DAILY_LIMIT=1000, YOUTUBE_QUOTA_USER_DAILY_LIMIT=150)
+class QuotaTests(YouTubeTestCase):
+    def execute(self, request):
+        return request.execute(http=HttpMockSequence([({"status": "200"}, b'{"items": []}')]))
+
+    def test_calls_are_charged_to_the_user(self):
+        youtube = build_youtube(get_credentials(self.user), self.user)
+        self.execute(youtube.search().list(part="id", q="cats"))
+        self.execute(youtube.videos().list(part="id", id="video0"))
+        self.execute(youtube.videos().list(part="id", id="video1"))
+
+        usage = {
+            row.method: (row.calls, row.units)
+            for row in QuotaUsage.objects.filter(user=self.user)
+        }
+        self.assertEqual(usage["youtube.search.list"], (1, 100))
+        self.assertEqual(usage["youtube.videos.list"], (2, 2))
+        self.assertAlmostEqual(QuotaBucket.objects.get(user=self.user).tokens, 48, places=0)
+
+    def test_empty_bucket_rejects_the_call(self):
+        youtube = build_youtube(get_credentials(self.user), self.user)
+        self.execute(youtube.search().list(part="id", q="cats"))
+        with self.assertRaises(QuotaExceeded) as context:
+            self.execute(youtube.search().list(part="id", q="dogs"))
+        self.assertGreater(context.exception.wait, 0)
+        self.assertEqual(QuotaUsage.objects.get().calls, 1)
+
+    @override_settings(YOUTUBE_QUOTA_DAILY_LIMIT=150)
+    def test_daily_budget_is_shared(self):
+        other = UserAccount.objects.create_user(
+            email="other@example.com", password="password", username="other"
+        )
+        self.execute(build_youtube(get_credentials(self.user), other).search().list(part="id"))
+        youtube = build_youtube(get_credentials(self.user), self.user)
+        with self.assertRaises(QuotaExceeded):
+            self.execute(youtube.search().list(part="id"))
+
+    @override_settings(YOUTUBE_QUOTA_DAILY_LIMIT=101)
+    def test_daily_budget_is_one_counter(self):
+        youtube = build_youtube(get_credentials(self.user), self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.execute(youtube.search().list(part="id"))
+        self.assertFalse(any("SUM(" in query["sql"] for query in queries))
+        self.execute(youtube.videos().list(part="id", id="video0"))
+        self.assertEqual(QuotaDay.objects.get().units, 101)
+
+        with self.assertRaises(QuotaExceeded):
+            self.execute(youtube.videos().list(part="id", id="video1"))
+        self.assertEqual(QuotaDay.objects.get().units, 101)
+        self.assertEqual(sum(QuotaUsage.objects.values_list("units", flat=True)), 101)
+
+    def test_exhausted_quota_answers_429(self):
+        def videos_list(**kwargs):
+            raise QuotaExceeded(wait=60)
+
+        youtube = FakeYouTube({"videos.list": videos_list})
+        with mock.patch("youtube.views.build_youtube", return_value=youtube):
+            response = self.client.get(reverse("youtube:liked_videos"))
+        self.assertEqual(response.status_code, 429)
+
+    def test_staff_quota_report(self):
+        self.execute(
+            build_youtube(get_credentials(self.user), self.user).search().list(part="id")
+        )
+        url = reverse("youtube:quota_status")
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        report = self.client.get(url).json()
+        self.assertEqual(report["used"], 100)
+        self.assertEqual(report["remaining"], 900)
+        self.assertEqual(report["users"][0]["user_id"], self.user.pk)
+
+
+def api_error(status, reason):
+    """
+    Return a fake transport response carrying a YouTube API error
+    """
+    body = {"error": {"code": status, "message": reason, "errors": [{"reason": reason}]}}
+    return {"status": str(status)}, json.dumps(body).encode()
+
+
+class TimingOutTransport:
+    """
+    Transport whose sockets time out before answering
+    """
+
+    def __init__(self):
+        self.requests = 0
+
+    def request(self, *args, **kwargs):
+        self.requests += 1
+        raise TimeoutError("timed out")
+
+
+class FakeClock:
+    """
+    Stand-in for the time module whose sleeps return at once
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class ResilienceTests(YouTubeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        patcher = mock.patch("youtube.execution.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def list_videos(self, http):
+        youtube = build_youtube(get_credentials(self.user), self.user)
+        return youtube.videos().list(part="id", id="video0").execute(http=http)
+
+    def test_transient_errors_are_retried(self):
+        http = HttpMockSequence([
+            api_error(503, "backendError"),
+            api_error(403, "rateLimitExceeded"),
+            ({"status": "200"}, b'{"items": [{"id": "video0"}]}'),
+        ])
+        self.assertEqual(self.list_videos(http)["items"][0]["id"], "video0")
+        self.assertEqual(len(self.clock.sleeps), 2)
+        self.assertEqual(QuotaUsage.objects.get().calls, 1)
+        metrics = breaker.metrics()
+        self.assertEqual(metrics["retries"], 2)
+        self.assertEqual(metrics["state"], "closed")
+
+    def test_client_errors_are_not_retried(self):
+        http = HttpMockSequence([api_error(403, "forbidden")])
+        with self.assertRaises(HttpError):
+            self.list_videos(http)
+        self.assertEqual(self.clock.sleeps, [])
+        self.assertEqual(breaker.metrics()["failures"], 0)
+
+    def test_retries_stop_at_the_deadline(self):
+        http = TimingOutTransport()
+        with mock.patch("youtube.execution.get_backoff", return_value=4), \
+                override_settings(YOUTUBE_API_DEADLINE=10):
+            with self.assertRaises(YouTubeUnavailable):
+                self.list_videos(http)
+        # Tries at 0s and after two 4s waits, the next wait would pass 10s
+        self.assertEqual(http.requests, 3)
+
+    def test_breaker_opens_and_recovers(self):
+        with mock.patch.object(breaker, "failure_threshold", 2), \
+                override_settings(YOUTUBE_API_DEADLINE=0):
+            for _ in range(2):
+                with self.assertRaises(YouTubeUnavailable):
+                    self.list_videos(HttpMockSequence([api_error(500, "backendError")]))
+            self.assertEqual(breaker.metrics()["state"], "open")
+
+            # Calls fail fast without reaching the transport
+            http = TimingOutTransport()
+            with self.assertRaises(YouTubeUnavailable):
+                self.list_videos(http)
+            self.assertEqual(http.requests, 0)
+
+            with mock.patch.object(breaker, "reset_timeout", 0):
+                self.list_videos(HttpMockSequence([({"status": "200"}, b'{"items": []}')]))
+        metrics = breaker.metrics()
+        self.assertEqual(metrics["state"], "closed")
+        self.assertEqual(metrics["opened"], 1)
+        self.assertEqual(metrics["rejected"], 1)
+
+    def test_throttling_does_not_open_the_breaker(self):
+        with mock.patch.object(breaker, "failure_threshold", 2):
+            for _ in range(3):
+                http = HttpMockSequence([
+                    api_error(429, "rateLimitExceeded"),
+                    api_error(403, "userRateLimitExceeded"),
+                    ({"status": "200"}, b'{"items": []}'),
+                ])
+                self.list_videos(http)
+        metrics = breaker.metrics()
+        self.assertEqual(metrics["state"], "closed")
+        self.assertEqual(metrics["failures"], 0)
+        self.assertEqual(metrics["retries"], 6)
+
+    def test_unavailable_youtube_answers_503(self):
+        breaker.record_failure()
+        with mock.patch.object(breaker, "failure_threshold", 1):
+            breaker.record_failure()
+            response = self.client.get(reverse("youtube:liked_videos"))
+        self.assertEqual(response.status_code, 503)
+
+        self.user.is_staff = True
+        self.user.save()
+        metrics = self.client.get(reverse("youtube:api_metrics")).json()
+        self.assertEqual(metrics["circuit_breaker"]["state"], "open")
+
+
+class CredentialsCacheTests(YouTubeTestCase):
+    def test_cached_credentials_skip_the_database(self):
+        credentials = get_credentials(self.user)
+        with self.assertNumQueries(0):
+            self.assertIs(get_credentials(self.user), credentials)
+
+    def test_expiring_token_is_refreshed_and_saved(self):
+        expiry = datetime.datetime.utcnow() + datetime.timedelta(minutes=1)
+        self.stored_credentials.credentials = json.dumps(
+            {**CREDENTIALS, "expiry": expiry.isoformat() + "Z"}
+        )
+        self.stored_credentials.save()
+
+        def refresh(credentials, request):
+            credentials.token = "new-access-token"
+            credentials.expiry = expiry + datetime.timedelta(hours=1)
+
+        with mock.patch.object(Credentials, "refresh", autospec=True, side_effect=refresh):
+            credentials = get_credentials(self.user)
+
+        self.assertEqual(credentials.token, "new-access-token")
+        self.stored_credentials.refresh_from_db()
+        self.assertEqual(
+            json.loads(self.stored_credentials.credentials)["token"], "new-access-token"
+        )
+
+    def test_unconnected_user(self):
+        self.stored_credentials.delete()
+        response = self.client.get(reverse("youtube:liked_videos"))
+        self.assertEqual(response.status_code, 400)
+
+
+class OAuthStateTests(YouTubeTestCase):
+    def callback(self, state):
+        flow = mock.Mock()
+        flow.credentials.to_json.return_value = json.dumps({**CREDENTIALS, "token": "new"})
+        with mock.patch("youtube.views.create_flow", return_value=flow):
+            return self.client.get(
+                reverse("youtube:youtube_callback"), {"state": state, "code": "code"}
+            )
+
+    def test_callback_replaces_the_users_credentials(self):
+        OAuthState.objects.create(user=self.user, state="first")
+        OAuthState.objects.create(user=self.user, state="second")
+        self.callback("second")
+
+        self.assertEqual(YouTubeCredentials.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(get_credentials(self.user).token, "new")
+        self.assertFalse(OAuthState.objects.exists())
+
+    def test_expired_state_is_rejected(self):
+        OAuthState.objects.create(
+            user=self.user,
+            state="old",
+            created_at=timezone.now() - datetime.timedelta(minutes=11),
+        )
+        self.assertEqual(self.callback("old").json(), {"error": "Invalid state"})
+        self.assertEqual(get_credentials(self.user).token, CREDENTIALS["token"])
+
+    def test_purge_deletes_expired_states(self):
+        old = timezone.now() - datetime.timedelta(minutes=30)
+        OAuthState.objects.create(user=self.user, state="old", created_at=old)
+        OAuthState.objects.create(user=self.user, state="legacy", created_at=old, credentials="{}")
+        OAuthState.objects.create(user=self.user, state="fresh")
+        call_command("purge_oauth_states", older_than=20, stdout=io.StringIO())
+        self.assertEqual(
+            set(OAuthState.objects.values_list("state", flat=True)), {"legacy", "fresh"}
+        )
+
+    def test_dedupe_keeps_the_newest_credentials(self):
+        other = UserAccount.objects.create_user(
+            email="other@example.com", password="password", username="other"
+        )
+        for token in ("stale", "newest"):
+            OAuthState.objects.create(
+                user=other, state=token, credentials=json.dumps({**CREDENTIALS, "token": token})
+            )
+            OAuthState.objects.create(
+                user=self.user, state=token, credentials=json.dumps({**CREDENTIALS, "token": token})
+            )
+        OAuthState.objects.create(user=other, state="pending")
+
+        call_command("dedupe_oauth_states", stdout=io.StringIO())
+
+        self.assertEqual(get_credentials(other).token, "newest")
+        # Credentials saved since the upgrade are kept
+        self.assertEqual(get_credentials(self.user).token, CREDENTIALS["token"])
+        self.assertEqual(list(OAuthState.objects.values_list("state", flat=True)), ["pending"])
+
+
+def write_client_config(path, client_id):
+    """
+    Write a client secrets file for the given client id
+    """
+    with open(path, "w", encoding="utf-8") as secrets_file:
+        json.dump({"web": {
+            "client_id": client_id,
+            "client_secret": "secret",
+            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+            "token_uri": "https://oauth2.googleapis.com/token",
+        }}, secrets_file)
+
+
+class ClientConfigTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "client.json")
+        write_client_config(self.path, "first")
+        # Reload the project's own config once the override is gone
+        self.addCleanup(oauth.load_client_config)
+        settings_override = override_settings(
+            YOUTUBE_CLIENT_SECRETS_FILE=self.path,
+            YOUTUBE_OAUTH_REDIRECT_URI="https://example.com/callback",
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        oauth.load_client_config()
+
+    def test_flows_use_the_loaded_config(self):
+        os.remove(self.path)
+        flow = oauth.create_flow(state="state")
+        self.assertEqual(flow.client_config["client_id"], "first")
+        self.assertEqual(flow.redirect_uri, "https://example.com/callback")
+        url, state = flow.authorization_url()
+        self.assertEqual(state, "state")
+        self.assertIn("youtube.force-ssl", url)
+
+    @skipUnless(hasattr(signal, "SIGHUP"), "needs SIGHUP")
+    def test_sighup_reloads_the_config(self):
+        self.addCleanup(signal.signal, signal.SIGHUP, signal.getsignal(signal.SIGHUP))
+        oauth.install_reload_handler()
+        write_client_config(self.path, "second")
+        os.kill(os.getpid(), signal.SIGHUP)
+        self.assertEqual(oauth.create_flow().client_config["client_id"], "second")
+
+    @skipUnless(hasattr(signal, "SIGHUP"), "needs SIGHUP")
+    def test_commands_keep_the_default_sighup(self):
+        # The test runner is a management command like the workers
+        self.assertEqual(signal.getsignal(signal.SIGHUP), signal.SIG_DFL)
+
+    def test_unreadable_config_is_kept(self):
+        with open(self.path, "w", encoding="utf-8") as secrets_file:
+            secrets_file.write("{")
+        with self.assertLogs("youtube.oauth", "WARNING"):
+            oauth.load_client_config()
+        self.assertEqual(oauth.create_flow().client_config["client_id"], "first")
+
+
+class UploadJobTests(YouTubeTestCase):
+    def setUp(self):
+        super().setUp()
+        upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, upload_dir)
+        settings_override = override_settings(
+            YOUTUBE_UPLOAD_DIR=upload_dir,
+            YOUTUBE_UPLOAD_CHUNK_SIZE=256 * 1024,
+            # Test transactions are not visible to other threads
+            YOUTUBE_UPLOAD_WORKERS=1,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def submit(self, content):
+        return self.client.post(
+            reverse("youtube:credentials"),
+            {
+                "title": "Clip",
+                "category": "Music",
+                "visibility": "private",
+                "video": SimpleUploadedFile("clip.mp4", content),
+            },
+        )
+
+    def test_upload_is_queued_and_processed_by_the_worker(self):
+        content = os.urandom(600 * 1024)
+        response = self.submit(content)
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()["status_url"]
+        self.assertEqual(self.client.get(status_url).json()["status"], "pending")
+
+        target = FakeUploadTarget()
+        youtube = FakeYouTube({"videos.insert": target})
+        with mock.patch("youtube.uploads.build_youtube", return_value=youtube):
+            call_command("run_upload_worker", "--once", stdout=io.StringIO())
+
+        self.assertEqual(target.received, content)
+        self.assertEqual(youtube.count("videos.insert"), 3)
+        status = self.client.get(status_url).json()
+        self.assertEqual(status["status"], "completed")
+        self.assertEqual(status["uploaded_bytes"], len(content))
+        self.assertEqual(status["video_id"], "uploaded-video")
+        self.assertFalse(os.path.exists(UploadJob.objects.get().file_path))
+
+    def test_batch_upload(self):
+        contents = [os.urandom(1000 + index) for index in range(3)]
+        response = self.client.post(reverse("youtube:upload_batch"), {
+            "videos": [
+                SimpleUploadedFile(f"clip{index}.mp4", content)
+                for index, content in enumerate(contents)
+            ],
+            "metadata": json.dumps([
+                {"title": "First", "category": "Music", "visibility": "public"},
+                {"title": "Second", "made_for_kids": "true"},
+            ]),
+        })
+        self.assertEqual(response.status_code, 202)
+        data = response.json()
+        self.assertEqual([video["name"] for video in data["videos"]],
+                         ["clip0.mp4", "clip1.mp4", "clip2.mp4"])
+        jobs = list(UploadJob.objects.order_by("pk"))
+        self.assertEqual([job.title for job in jobs], ["First", "Second", None])
+        self.assertEqual(jobs[0].category_id, "10")
+        self.assertTrue(jobs[1].made_for_kids)
+
+        targets = {}
+
+        def insert(body, **kwargs):
+            target = targets.setdefault(body["snippet"]["title"], FakeUploadTarget())
+            return target(body=body, **kwargs)
+
+        youtube = FakeYouTube({"videos.insert": insert})
+        with mock.patch("youtube.uploads.build_youtube", return_value=youtube):
+            call_command("run_upload_worker", "--once", stdout=io.StringIO())
+
+        self.assertEqual(
+            [target.received for target in targets.values()], contents
+        )
+        status = self.client.get(data["status_url"]).json()
+        self.assertEqual(status["completed"], 3)
+        self.assertEqual(status["uploaded_bytes"], sum(map(len, contents)))
+        self.assertEqual([video["status"] for video in status["videos"]], ["completed"] * 3)
+
+    @override_settings(YOUTUBE_UPLOAD_BATCH_MAX_FILES=1)
+    def test_batch_limits(self):
+        videos = [SimpleUploadedFile(f"clip{index}.mp4", b"video") for index in range(2)]
+        response = self.client.post(reverse("youtube:upload_batch"), {"videos": videos})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse("youtube:upload_batch"), {
+            "videos": videos[:1], "metadata": json.dumps([{}, {}]),
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UploadJob.objects.exists())
+
+    @override_settings(YOUTUBE_UPLOAD_USER_CONCURRENCY=1)
+    def test_users_upload_one_video_at_a_time(self):
+        other = UserAccount.objects.create_user(
+            email="other@example.com", password="password", username="other"
+        )
+        first = UploadJob.objects.create(user=self.user, file_path="/first")
+        UploadJob.objects.create(user=self.user, file_path="/second")
+        third = UploadJob.objects.create(user=other, file_path="/third")
+
+        self.assertEqual(claim_next_job(), first)
+        # The user already has a video uploading
+        self.assertEqual(claim_next_job(), third)
+        self.assertIsNone(claim_next_job())
+
+    @override_settings(YOUTUBE_UPLOAD_USER_CONCURRENCY=1)
+    def test_claim_recounts_after_waiting_for_the_user(self):
+        other = UserAccount.objects.create_user(
+            email="other@example.com", password="password", username="other"
+        )
+        first = UploadJob.objects.create(user=self.user, file_path="/first")
+        second = UploadJob.objects.create(user=self.user, file_path="/second")
+        third = UploadJob.objects.create(user=other, file_path="/third")
+        lock_user = uploads.lock_user
+
+        def claimed_while_waiting(user_id):
+            # Another worker claimed a video of this user and committed
+            UploadJob.objects.filter(pk=second.pk).update(status=UploadJob.RUNNING)
+            lock_user(user_id)
+
+        with mock.patch("youtube.uploads.lock_user", side_effect=claimed_while_waiting):
+            self.assertEqual(claim_next_job(), third)
+        first.refresh_from_db()
+        self.assertEqual(first.status, UploadJob.PENDING)
+
+    def test_failed_upload_is_reported(self):
+        status_url = self.submit(b"video")
+
+        def insert(**kwargs):
+            raise RuntimeError("quotaExceeded")
+
+        youtube = FakeYouTube({"videos.insert": insert})
+        with mock.patch("youtube.uploads.build_youtube", return_value=youtube), \
+                self.assertLogs("youtube.uploads", "ERROR"):
+            call_command("run_upload_worker", "--once", stdout=io.StringIO())
+
+        status = self.client.get(status_url.json()["status_url"]).json()
+        self.assertEqual(status["status"], "failed")
+        self.assertEqual(status["error"], "quotaExceeded")
+
+    def test_failed_chunk_is_retried_from_the_committed_offset(self):
+        content = os.urandom(700 * 1024)
+        self.submit(content)
+
+        with StandInUploadServer(fail_chunks=[2]) as server, \
+                mock.patch("youtube.uploads.build_youtube", server.build_youtube), \
+                mock.patch("youtube.uploads.RETRY_DELAY", 0), \
+                self.assertLogs("youtube.uploads", "WARNING"):
+            call_command("run_upload_worker", "--once", stdout=io.StringIO())
+
+        self.assertEqual(server.received, content)
+        self.assertEqual(server.sessions, 1)
+        # Only the rejected chunk is sent twice
+        self.assertEqual(server.put_bytes, len(content) + 256 * 1024)
+        self.assertEqual(UploadJob.objects.get().status, UploadJob.COMPLETED)
+
+    def test_restarted_worker_resumes_the_session(self):
+        content = os.urandom(700 * 1024)
+        self.submit(content)
+        save = UploadJob.save
+
+        def save_then_die(job, *args, **kwargs):
+            save(job, *args, **kwargs)
+            if job.uploaded_bytes == 512 * 1024:
+                raise WorkerKilled
+
+        with StandInUploadServer() as server, \
+                mock.patch("youtube.uploads.build_youtube", server.build_youtube):
+            with mock.patch.object(UploadJob, "save", autospec=True, side_effect=save_then_die):
+                with self.assertRaises(WorkerKilled):
+                    call_command("run_upload_worker", "--once", stdout=io.StringIO())
+
+            job = UploadJob.objects.get()
+            self.assertEqual(job.status, UploadJob.RUNNING)
+            self.assertTrue(os.path.exists(job.file_path))
+
+            # Nothing happens until the dead worker's job goes stale
+            call_command("run_upload_worker", "--once", stdout=io.StringIO())
+            self.assertEqual(UploadJob.objects.get().status, UploadJob.RUNNING)
+            UploadJob.objects.update(updated_at=timezone.now() - datetime.timedelta(hours=1))
+            call_command("run_upload_worker", "--once", stdout=io.StringIO())
+
+        self.assertEqual(server.received, content)
+        self.assertEqual(server.sessions, 1)
+        self.assertEqual(server.put_bytes, len(content))
+        job = UploadJob.objects.get()
+        self.assertEqual(job.status, UploadJob.COMPLETED)
+        self.assertEqual(job.video_id, "stand-in-video")
+        self.assertEqual(job.attempts, 2)
+
+    def test_spooled_video_is_moved_not_copied(self):
+        video = TemporaryUploadedFile("clip.mp4", "video/mp4", 5, None)
+        video.write(b"video")
+        video.flush()
+        spooled_path = video.temporary_file_path()
+
+        path = store_video(video)
+        video.close()
+
+        self.assertFalse(os.path.exists(spooled_path))
+        with open(path, "rb") as stored:
+            self.assertEqual(stored.read(), b"video")
+
+    def test_pipelined_upload_is_forwarded_while_received(self):
+        content = os.urandom(700 * 1024)
+        youtube = FakeYouTube({"videos.update": lambda **kwargs: kwargs["body"]})
+
+        with StandInUploadServer() as server, \
+                mock.patch("youtube.upload_handlers.get_upload_url", return_value=server.url), \
+                mock.patch("youtube.upload_handlers.create_session", return_value=requests.Session()), \
+                mock.patch("youtube.upload_handlers.build_youtube", return_value=youtube):
+            response = self.client.post(
+                reverse("youtube:credentials") + "?pipeline=true",
+                {
+                    "title": "Clip",
+                    "category": "Music",
+                    "visibility": "public",
+                    "video": SimpleUploadedFile("clip.mp4", content),
+                },
+            )
+
+        self.assertEqual(response.json()["video_id"], "stand-in-video")
+        self.assertEqual(server.received, content)
+        self.assertEqual(server.metadata["status"]["privacyStatus"], "private")
+        update = youtube.calls[0][1]["body"]
+        self.assertEqual(update["id"], "stand-in-video")
+        self.assertEqual(update["snippet"]["title"], "Clip")
+        self.assertEqual(update["status"]["privacyStatus"], "public")
+        job = UploadJob.objects.get()
+        self.assertEqual(job.status, UploadJob.COMPLETED)
+        self.assertEqual(job.uploaded_bytes, len(content))
+        self.assertEqual(os.listdir(settings.YOUTUBE_UPLOAD_DIR), [])
+
+    def test_pipelined_upload_resumes_from_the_stored_offset(self):
+        content = os.urandom(1100 * 1024)
+        youtube = FakeYouTube({"videos.update": lambda **kwargs: kwargs["body"]})
+
+        with StandInUploadServer(fail_chunks=[2], partial_chunks=[3, 6]) as server, \
+                mock.patch("youtube.upload_handlers.get_upload_url", return_value=server.url), \
+                mock.patch("youtube.upload_handlers.create_session", return_value=requests.Session()), \
+                mock.patch("youtube.upload_handlers.build_youtube", return_value=youtube), \
+                mock.patch("youtube.upload_handlers.RETRY_DELAY", 0), \
+                self.assertLogs("youtube.upload_handlers", "WARNING"):
+            response = self.client.post(
+                reverse("youtube:credentials") + "?pipeline=true",
+                {"title": "Clip", "video": SimpleUploadedFile("clip.mp4", content)},
+            )
+
+        self.assertEqual(response.json()["video_id"], "stand-in-video")
+        self.assertEqual(server.received, content)
+        self.assertEqual(server.sessions, 1)
+        self.assertEqual(os.listdir(settings.YOUTUBE_UPLOAD_DIR), [])
+
+    def test_status_of_another_users_job(self):
+        other = UserAccount.objects.create_user(
+            email="other@example.com", password="password", username="other"
+        )
+        job = UploadJob.objects.create(user=other, file_path="/nonexistent")
+        response = self.client.get(reverse("youtube:upload_status", args=[job.pk]))
+        self.assertEqual(response.status_code, 404)
+
+
+@skipUnless(connection.features.has_select_for_update, "needs row locks")
+@override_settings(YOUTUBE_UPLOAD_USER_CONCURRENCY=2)
+class ConcurrentClaimTests(TransactionTestCase):
+    def test_concurrent_claims_respect_the_user_limit(self):
+        user = UserAccount.objects.create_user(
+            email="user@example.com", password="password", username="user"
+        )
+        for index in range(6):
+            UploadJob.objects.create(user=user, file_path=f"/clip{index}")
+        barrier = threading.Barrier(4)
+        claimed = []
+
+        def claim():
+            try:
+                barrier.wait()
+                claimed.append(claim_next_job())
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=claim) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len([job for job in claimed if job is not None]), 2)
+        self.assertEqual(UploadJob.objects.filter(status=UploadJob.RUNNING).count(), 2)
+
+
+class TransportPoolTests(YouTubeTestCase):
+    def test_clients_of_a_thread_share_a_transport(self):
+        credentials = get_credentials(self.user)
+        first = build_youtube(credentials, self.user)._http.http
+        self.assertIs(build_youtube(credentials, self.user)._http.http, first)
+
+        others = []
+        thread = threading.Thread(
+            target=lambda: others.append(build_youtube(credentials, self.user)._http.http)
+        )
+        thread.start()
+        thread.join()
+        self.assertIsNot(others[0], first)
+        self.assertNotIn(308, first.redirect_codes)
+
+    def test_pool_is_bounded(self):
+        pool = TransportPool(object, max_size=2, idle_timeout=60)
+        transports = []
+        # Keep every thread alive until all of them have a transport
+        barrier = threading.Barrier(3)
+
+        def get():
+            transports.append(pool.get())
+            barrier.wait()
+
+        threads = [threading.Thread(target=get) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(pool.transports), 2)
+        self.assertEqual(len({id(transport) for transport in transports}), 3)
+
+    def test_idle_transports_are_dropped(self):
+        pool = TransportPool(object, max_size=2, idle_timeout=60)
+        with mock.patch("youtube.transport.time.monotonic", return_value=0):
+            transport = pool.get()
+        with mock.patch("youtube.transport.time.monotonic", return_value=30):
+            self.assertIs(pool.get(), transport)
+        with mock.patch("youtube.transport.time.monotonic", return_value=100):
+            self.assertIsNot(pool.get(), transport)
+
+
+class StandInApiHandler(BaseHTTPRequestHandler):
+    """
+    Answers every GET with an empty videos.list response over keep-alive
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        body = b'{"items": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInTLSServer(ThreadingHTTPServer):
+    """
+    Local HTTPS stand-in for the YouTube API with a self-signed certificate
+    """
+
+    def __init__(self, directory):
+        super().__init__(("127.0.0.1", 0), StandInApiHandler)
+        self.certificate = os.path.join(directory, "cert.pem")
+        key = os.path.join(directory, "key.pem")
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+             "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+             "-keyout", key, "-out", self.certificate],
+            check=True, capture_output=True,
+        )
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self.certificate, key)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+        self.url = f"https://127.0.0.1:{self.server_port}/"
+        self.connections = 0
+
+    def create_http(self):
+        http = create_http()
+        http.ca_certs = self.certificate
+        return http
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+@skipUnless(os.getenv("RUN_BENCHMARKS"), "set RUN_BENCHMARKS=1 to run benchmarks")
+@skipUnless(shutil.which("openssl"), "needs openssl")
+class TransportPoolBenchmark(SimpleTestCase):
+    def test_pooled_transport_skips_handshakes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        rounds = 100
+        with StandInTLSServer(directory) as server:
+            document = dict(get_discovery_document(), rootUrl=server.url)
+            pool = TransportPool(server.create_http, max_size=4, idle_timeout=60)
+
+            def call(http):
+                youtube = build_from_document(document, http=http)
+                youtube.videos().list(part="id", id="video0").execute()
+
+            per_fresh = timeit.timeit(lambda: call(server.create_http()), number=rounds) / rounds
+            fresh_connections, server.connections = server.connections, 0
+            per_pooled = timeit.timeit(lambda: call(pool.get()), number=rounds) / rounds
+
+        print(
+            f"\nfresh transport: {per_fresh * 1000:.2f} ms/call, {fresh_connections} handshakes, "
+            f"pooled transport: {per_pooled * 1000:.2f} ms/call, {server.connections} handshakes"
+        )
+        self.assertEqual(server.connections, 1)
+        self.assertLess(per_pooled, per_fresh)
+
+
+@skipUnless(os.getenv("RUN_BENCHMARKS"), "set RUN_BENCHMARKS=1 to run benchmarks")
+class ClientFactoryBenchmark(SimpleTestCase):
+    def test_factory_is_cheaper_than_build(self):
+        credentials = Credentials.from_authorized_user_info(CREDENTIALS)
+        rounds = 50
+        build_youtube(credentials)
+
+        per_build = timeit.timeit(
+            lambda: build("youtube", "v3", credentials=credentials), number=rounds
+        ) / rounds
+        per_factory = timeit.timeit(
+            lambda: build_youtube(credentials), number=rounds
+        ) / rounds
+
+        print(
+            f"\nbuild(): {per_build * 1000:.2f} ms/request, "
+            f"build_youtube(): {per_factory * 1000:.2f} ms/request"
+        )
+        self.assertLess(per_factory, per_build)
+
+
+def written_bytes():
+    """
+    Return how many bytes this process has passed to write() so far
+    """
+    with open("/proc/self/io", encoding="ascii") as io_stats:
+        for line in io_stats:
+            if line.startswith("wchar:"):
+                return int(line.split()[1])
+    return 0
+
+
+def copy_video(video, directory):
+    """
+    The upload path before store_video, copying the video chunk by chunk
+    """
+    with tempfile.NamedTemporaryFile(delete=False, dir=directory) as temp_file:
+        for chunk in video.chunks():
+            temp_file.write(chunk)
+    return temp_file.name
+
+
+@skipUnless(os.getenv("RUN_BENCHMARKS"), "set RUN_BENCHMARKS=1 to run benchmarks")
+@skipUnless(os.path.exists("/proc/self/io"), "needs /proc/self/io")
+class StoreVideoBenchmark(SimpleTestCase):
+    def spool(self, size):
+        video = TemporaryUploadedFile("clip.mp4", "video/mp4", size, None)
+        block = os.urandom(1024 * 1024)
+        for _ in range(size // len(block)):
+            video.write(block)
+        video.flush()
+        video.seek(0)
+        self.addCleanup(video.close)
+        return video
+
+    def measure(self, store, size):
+        video = self.spool(size)
+        before = written_bytes()
+        start = timeit.default_timer()
+        path = store(video)
+        elapsed = timeit.default_timer() - start
+        written = written_bytes() - before
+        os.remove(path)
+        return written, elapsed
+
+    def test_store_video(self):
+        upload_dir = tempfile.mkdtemp(dir=tempfile.gettempdir())
+        self.addCleanup(shutil.rmtree, upload_dir)
+        with override_settings(YOUTUBE_UPLOAD_DIR=upload_dir):
+            for size in (100 * 1024 * 1024, 1024 * 1024 * 1024):
+                copied = self.measure(lambda video: copy_video(video, upload_dir), size)
+                moved = self.measure(store_video, size)
+                print(
+                    f"\n{size // (1024 * 1024)} MB: "
+                    f"copy {copied[0] // (1024 * 1024)} MB written in {copied[1]:.2f}s, "
+                    f"store_video {moved[0] // (1024 * 1024)} MB written in {moved[1]:.3f}s"
+                )
+                self.assertLess(moved[0], copied[0])
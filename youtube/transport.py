@@ -0,0 +1,88 @@
+"""
+Keep-alive HTTP transports shared by the YouTube clients of a thread
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from django.conf import settings
+from googleapiclient.http import build_http
+
+
+class TransportPool:
+    """
+    Hands every thread its own transport, kept between requests so its
+    connections are reused, for at most max_size threads and until it
+    has been idle for idle_timeout seconds
+    """
+
+    def __init__(self, factory, max_size, idle_timeout):
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.transports = OrderedDict()
+
+    def get(self):
+        """
+        Return the transport of the calling thread
+        """
+        key = threading.get_ident()
+        now = time.monotonic()
+        with self.lock:
+            entry = self.transports.pop(key, None)
+            self.evict(now)
+            if entry is None or now - entry[1] >= self.idle_timeout:
+                transport = self.factory()
+            else:
+                transport = entry[0]
+            self.transports[key] = (transport, now)
+            while len(self.transports) > self.max_size:
+                self.transports.popitem(last=False)
+        return transport
+
+    def evict(self, now):
+        """
+        Drop the transports that have been idle for too long
+        """
+        while self.transports:
+            _, last_used = next(iter(self.transports.values()))
+            if now - last_used < self.idle_timeout:
+                break
+            self.transports.popitem(last=False)
+
+    def clear(self):
+        """
+        Drop every transport
+        """
+        with self.lock:
+            self.transports.clear()
+
+
+def create_http():
+    """
+    Return an httplib2 transport that gives up on unresponsive sockets
+    after YOUTUBE_API_TIMEOUT seconds
+    """
+    # build_http() also stops httplib2 from following the 308 responses
+    # of resumable uploads
+    http = build_http()
+    http.timeout = settings.YOUTUBE_API_TIMEOUT
+    return http
+
+
+# Used by the API clients
+http_pool = TransportPool(
+    create_http,
+    max_size=settings.YOUTUBE_HTTP_POOL_SIZE,
+    idle_timeout=settings.YOUTUBE_HTTP_IDLE_TIMEOUT,
+)
+
+# Used to refresh access tokens
+session_pool = TransportPool(
+    requests.Session,
+    max_size=settings.YOUTUBE_HTTP_POOL_SIZE,
+    idle_timeout=settings.YOUTUBE_HTTP_IDLE_TIMEOUT,
+)
@@ -0,0 +1,251 @@
+"""
+Upload handler forwarding videos to YouTube while the client is still
+sending them
+"""
+
+import logging
+import queue
+import threading
+import time
+
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.urls import reverse
+from google.auth.transport.requests import AuthorizedSession
+
+from .client import build_youtube, get_discovery_document
+from .credentials import get_credentials
+from .quota import consume_quota
+from .uploads import CHUNK_RETRIES, RETRY_DELAY, get_chunk_size, get_video_body, is_retryable
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of received chunks waiting to be forwarded to YouTube
+QUEUE_SIZE = 64
+
+# Category given to a streamed video if the user did not pick one,
+# YouTube refuses to update a snippet without one
+DEFAULT_CATEGORY_ID = "22"
+
+
+def get_upload_url():
+    """
+    Return the resumable videos.insert endpoint
+    """
+    document = get_discovery_document()
+    return f"{document['rootUrl']}upload/{document['servicePath']}youtube/v3/videos"
+
+
+def create_session(credentials):
+    """
+    Return an HTTP session authorized with the given credentials
+    """
+    return AuthorizedSession(credentials)
+
+
+class ResumableSender(threading.Thread):
+    """
+    Sends the chunks put on its queue to a resumable upload session of
+    unknown length
+    """
+
+    def __init__(self, session, upload_uri, chunk_size):
+        super().__init__(daemon=True)
+        self.session = session
+        self.upload_uri = upload_uri
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.aborted = False
+        self.offset = 0
+        self.response = None
+        self.error = None
+
+    def put_chunk(self, data, total=None):
+        """
+        Send data starting at the committed offset, or ask for the committed
+        offset if data is empty, and return the new committed offset and
+        the created video once the total size is stored
+        """
+        if data:
+            content_range = f"bytes {self.offset}-{self.offset + len(data) - 1}/{total or '*'}"
+        else:
+            content_range = f"bytes */{total or '*'}"
+        response = self.session.put(
+            self.upload_uri, data=bytes(data), headers={"Content-Range": content_range}
+        )
+        if response.status_code == 308:
+            # YouTube may keep only the start of a chunk, Range says how much
+            stored = response.headers.get("Range")
+            return int(stored.rsplit("-", 1)[1]) + 1 if stored else 0, None
+        if total is not None and response.status_code in (200, 201):
+            return total, response.json()
+        response.raise_for_status()
+        raise RuntimeError(f"Upload chunk rejected with status {response.status_code}")
+
+    def send(self, buffer, size, total=None):
+        """
+        Send the first size bytes of buffer, which starts at the committed
+        offset, retrying transient failures from the offset YouTube
+        reports, and drop the bytes it stored from buffer
+        """
+        end = self.offset + size
+        failures = 0
+        while True:
+            try:
+                if failures:
+                    self.commit(buffer, *self.put_chunk(b"", total))
+                    if self.response is not None or self.offset >= end:
+                        return
+                start = self.offset
+                self.commit(buffer, *self.put_chunk(buffer[:end - start], total))
+                if self.offset == start and self.response is None:
+                    raise RuntimeError("Upload chunk was not stored")
+                return
+            # pylint: disable=broad-exception-caught
+            except Exception as exception:
+                if not is_retryable(exception) or failures >= CHUNK_RETRIES:
+                    raise
+                failures += 1
+                logger.warning("Retrying streamed upload chunk: %s", exception)
+                time.sleep(RETRY_DELAY * 2 ** (failures - 1))
+
+    def commit(self, buffer, offset, response):
+        """
+        Move the committed offset forward, forgetting the stored bytes
+        """
+        if not self.offset <= offset <= self.offset + len(buffer):
+            raise RuntimeError(f"Upload committed an unexpected offset {offset}")
+        del buffer[:offset - self.offset]
+        self.offset = offset
+        self.response = response
+
+    def run(self):
+        # Bytes received from the client and not yet stored by YouTube
+        buffer = bytearray()
+        try:
+            while True:
+                data = self.queue.get()
+                if data is None:
+                    break
+                buffer += data
+                while len(buffer) >= self.chunk_size:
+                    self.send(buffer, self.chunk_size)
+            if not self.aborted:
+                total = self.offset + len(buffer)
+                while self.response is None:
+                    self.send(buffer, len(buffer), total)
+        # pylint: disable=broad-exception-caught
+        except Exception as exception:
+            logger.error(str(exception))
+            self.error = exception
+            # Keep draining so the request thread never blocks on a full queue
+            while self.queue.get() is not None:
+                pass
+
+
+class StreamedVideo(UploadedFile):
+    """
+    A video that was forwarded to YouTube instead of being stored
+    """
+
+    def __init__(self, name, content_type, size, charset, user, response, error):
+        super().__init__(None, name, content_type, size, charset)
+        self.user = user
+        self.response = response
+        self.error = error
+
+    def finish(self, job):
+        """
+        Apply the metadata of the given job to the uploaded video and
+        return its id
+        """
+        if self.error is not None:
+            raise self.error
+        body = get_video_body(job)
+        body["id"] = self.response["id"]
+        body["snippet"]["categoryId"] = job.category_id or DEFAULT_CATEGORY_ID
+        youtube = build_youtube(get_credentials(self.user), self.user)
+        youtube.videos().update(part="snippet,status", body=body).execute()
+        return self.response["id"]
+
+
+class YouTubeStreamingUploadHandler(FileUploadHandler):
+    """
+    Starts a resumable YouTube upload as soon as the video part of a
+    pipeline=true upload request begins and forwards every chunk to it
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.credentials = None
+        self.sender = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if self.request.path != reverse("youtube:credentials"):
+            return
+        if self.request.GET.get("pipeline", "").lower() not in ("1", "true", "yes"):
+            return
+        user = getattr(self.request, "user", None)
+        if user is not None and user.is_authenticated:
+            self.credentials = get_credentials(user)
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        if self.credentials is None or field_name != "video":
+            return
+
+        # The real metadata only arrives with the rest of the form, so the
+        # video starts out private and is updated once the request is read
+        session = create_session(self.credentials)
+        try:
+            consume_quota(self.request.user, "youtube.videos.insert")
+            response = session.post(
+                get_upload_url(),
+                params={"uploadType": "resumable", "part": "snippet,status"},
+                json={
+                    "snippet": {"title": self.file_name},
+                    "status": {"privacyStatus": "private"},
+                },
+                headers={"X-Upload-Content-Type": self.content_type or "video/*"},
+            )
+            response.raise_for_status()
+        # pylint: disable=broad-exception-caught
+        except Exception as exception:
+            # Let the default handlers store the video for the upload worker,
+            # which also waits for quota to be available
+            logger.error(str(exception))
+            return
+
+        self.sender = ResumableSender(
+            session, response.headers["Location"], get_chunk_size()
+        )
+        self.sender.start()
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.sender is None:
+            return raw_data
+        self.sender.queue.put(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.sender is None:
+            return None
+        sender, self.sender = self.sender, None
+        sender.queue.put(None)
+        sender.join()
+        return StreamedVideo(
+            self.file_name,
+            self.content_type,
+            file_size,
+            self.charset,
+            self.request.user,
+            sender.response,
+            sender.error,
+        )
+
+    def upload_interrupted(self):
+        if self.sender is not None:
+            self.sender.aborted = True
+            self.sender.queue.put(None)
+            self.sender = None
@@ -0,0 +1,311 @@
+"""
+Background upload of videos to YouTube
+"""
+
+import datetime
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import httplib2
+import requests
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload
+
+from authentication.models import UserAccount
+
+from .client import build_youtube
+from .credentials import get_credentials
+from .execution import YouTubeUnavailable
+from .models import UploadJob
+from .quota import QuotaExceeded
+
+logger = logging.getLogger(__name__)
+
+# Resumable upload chunks must be a multiple of this size
+CHUNK_ALIGNMENT = 256 * 1024
+
+# Running jobs that made no progress for this long belong to a dead worker
+STALE_AFTER = datetime.timedelta(minutes=10)
+
+# Number of times a job is picked up before it is given up on
+MAX_ATTEMPTS = 5
+
+# Number of times a failed chunk is retried before the attempt is abandoned
+CHUNK_RETRIES = 3
+
+# Base delay in seconds between chunk retries, doubled on every retry
+RETRY_DELAY = 1.0
+
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+def get_chunk_size():
+    """
+    Return the configured chunk size rounded down to a multiple of
+    CHUNK_ALIGNMENT
+    """
+    chunks = max(1, settings.YOUTUBE_UPLOAD_CHUNK_SIZE // CHUNK_ALIGNMENT)
+    return chunks * CHUNK_ALIGNMENT
+
+
+def is_retryable(exception):
+    """
+    Check if the given upload error is worth retrying
+    """
+    if isinstance(exception, HttpError):
+        return exception.resp.status in RETRYABLE_STATUSES
+    if isinstance(exception, requests.HTTPError):
+        return exception.response.status_code in RETRYABLE_STATUSES
+    return isinstance(exception, (httplib2.HttpLib2Error, OSError))
+
+
+def store_video(video):
+    """
+    Put the uploaded video where the upload worker can find it and
+    return its path, writing it to disk at most once
+    """
+    os.makedirs(settings.YOUTUBE_UPLOAD_DIR, exist_ok=True)
+    if isinstance(video, TemporaryUploadedFile):
+        # Django already spooled the video to disk, take its file over
+        # instead of copying it. This is a rename when both directories
+        # are on the same filesystem
+        file_descriptor, path = tempfile.mkstemp(dir=settings.YOUTUBE_UPLOAD_DIR)
+        os.close(file_descriptor)
+        file_move_safe(video.temporary_file_path(), path, allow_overwrite=True)
+        return path
+
+    # Small videos are still in memory and get written exactly once
+    with tempfile.NamedTemporaryFile(delete=False, dir=settings.YOUTUBE_UPLOAD_DIR) as temp_file:
+        for chunk in video.chunks():
+            temp_file.write(chunk)
+    return temp_file.name
+
+
+def get_busy_users(stale):
+    """
+    Return the users already uploading as many videos at once as
+    YOUTUBE_UPLOAD_USER_CONCURRENCY allows
+    """
+    return (
+        UploadJob.objects.filter(status=UploadJob.RUNNING, updated_at__gte=stale)
+        .values("user")
+        .annotate(running=Count("pk"))
+        .filter(running__gte=settings.YOUTUBE_UPLOAD_USER_CONCURRENCY)
+        .values("user")
+    )
+
+
+def lock_user(user_id):
+    """
+    Lock the given user's row until the current transaction ends
+    """
+    UserAccount.objects.select_for_update(no_key=True).only("pk").get(pk=user_id)
+
+
+def claim_next_job(exclude=()):
+    """
+    Mark the oldest pending or abandoned job of a user who is not busy
+    as running and return it, or None if there is nothing to do
+    """
+    stale = timezone.now() - STALE_AFTER
+    busy_users = []
+    while True:
+        with transaction.atomic():
+            job = (
+                UploadJob.objects.select_for_update(skip_locked=True)
+                .filter(
+                    Q(status=UploadJob.PENDING)
+                    | Q(status=UploadJob.RUNNING, updated_at__lt=stale)
+                )
+                .exclude(pk__in=exclude)
+                .exclude(user__in=busy_users)
+                .exclude(user__in=get_busy_users(stale))
+                .order_by("created_at")
+                .first()
+            )
+            if job is None:
+                return None
+            # Claims for the same user wait here for each other, so the
+            # count below sees the jobs the others just claimed
+            lock_user(job.user_id)
+            running = UploadJob.objects.filter(
+                user_id=job.user_id, status=UploadJob.RUNNING, updated_at__gte=stale
+            ).count()
+            if running < settings.YOUTUBE_UPLOAD_USER_CONCURRENCY:
+                job.status = UploadJob.RUNNING
+                job.attempts += 1
+                job.save(update_fields=["status", "attempts", "updated_at"])
+                return job
+        busy_users.append(job.user_id)
+
+
+def get_video_body(job):
+    """
+    Build the videos.insert request body for the given job
+    """
+    return {
+        "snippet": {
+            "title": job.title,
+            "description": job.description,
+            "categoryId": job.category_id,
+            "defaultLanguage": "en",
+            "defaultAudioLanguage": "en"
+        },
+        "status": {
+            "privacyStatus": job.visibility,
+            "selfDeclaredMadeForKids": job.made_for_kids
+        }
+    }
+
+
+def create_upload_request(youtube, job):
+    """
+    Build the resumable videos.insert request for the given job,
+    continuing the session of a previous attempt if there is one
+    """
+    media = MediaFileUpload(job.file_path, chunksize=get_chunk_size(), resumable=True)
+    request = youtube.videos().insert(
+        part="snippet,status",
+        body=get_video_body(job),
+        media_body=media
+    )
+    if job.upload_uri:
+        # Ask YouTube how many bytes it committed before sending anything,
+        # the same way the client library recovers from a failed chunk
+        request.resumable_uri = job.upload_uri
+        request.resumable_progress = job.uploaded_bytes
+        request._in_error_state = True  # pylint: disable=protected-access
+    return request
+
+
+def upload_chunks(job, request):
+    """
+    Send the remaining chunks of the given request, saving the session
+    and the acknowledged offset after every chunk
+    """
+    response = None
+    failures = 0
+    while response is None:
+        try:
+            status, response = request.next_chunk()
+        # pylint: disable=broad-exception-caught
+        except Exception as exception:
+            if not is_retryable(exception) or failures >= CHUNK_RETRIES:
+                raise
+            failures += 1
+            logger.warning("Retrying chunk of upload job %s: %s", job.pk, exception)
+            time.sleep(RETRY_DELAY * 2 ** (failures - 1))
+            continue
+
+        failures = 0
+        if status:
+            job.upload_uri = request.resumable_uri
+            job.uploaded_bytes = status.resumable_progress
+            job.save(update_fields=["upload_uri", "uploaded_bytes", "updated_at"])
+    return response
+
+
+def finish_job(job, status, **fields):
+    """
+    Record the final state of the given job and delete its video
+    """
+    job.status = status
+    for name, value in fields.items():
+        setattr(job, name, value)
+    job.save(update_fields=["status", "updated_at", *fields])
+    if os.path.exists(job.file_path):
+        os.remove(job.file_path)
+
+
+def process_upload_job(job):
+    """
+    Upload the video of the given job to YouTube, resuming from the
+    last acknowledged chunk of a previous attempt
+    """
+    try:
+        credentials = get_credentials(job.user)
+        if credentials is None:
+            raise RuntimeError("YouTube account not connected")
+
+        youtube = build_youtube(credentials, job.user)
+        try:
+            response = upload_chunks(job, create_upload_request(youtube, job))
+        except HttpError as exception:
+            if not job.upload_uri or exception.resp.status not in (404, 410):
+                raise
+            # The resumable session expired, start a new one
+            job.upload_uri = None
+            job.uploaded_bytes = 0
+            job.save(update_fields=["upload_uri", "uploaded_bytes", "updated_at"])
+            response = upload_chunks(job, create_upload_request(youtube, job))
+    # pylint: disable=broad-exception-caught
+    except Exception as exception:
+        logger.error(str(exception))
+        if isinstance(exception, (QuotaExceeded, YouTubeUnavailable)):
+            # Wait in the queue for quota or for YouTube to come back
+            # without using up an attempt
+            job.status = UploadJob.PENDING
+            job.attempts -= 1
+            job.save(update_fields=["status", "attempts", "updated_at"])
+        elif is_retryable(exception) and job.attempts < MAX_ATTEMPTS:
+            # Leave the video and session in place for the next attempt
+            job.status = UploadJob.PENDING
+            job.save(update_fields=["status", "updated_at"])
+        else:
+            finish_job(job, UploadJob.FAILED, error=str(exception))
+        return job
+
+    finish_job(
+        job,
+        UploadJob.COMPLETED,
+        uploaded_bytes=job.total_bytes,
+        video_id=response["id"],
+    )
+    return job
+
+
+def run_pending_jobs(workers=1):
+    """
+    Process pending jobs on up to the given number of threads until the
+    queue is empty, returning how many were processed
+    """
+    processed = []
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            # Jobs sent back to the queue wait for the next run
+            with lock:
+                exclude = list(processed)
+            job = claim_next_job(exclude=exclude)
+            if job is None:
+                return
+            with lock:
+                processed.append(job.pk)
+            process_upload_job(job)
+
+    def work_in_thread():
+        try:
+            work()
+        finally:
+            # Every thread has its own database connection
+            connection.close()
+
+    if workers <= 1:
+        work()
+    else:
+        threads = [threading.Thread(target=work_in_thread) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return len(processed)
@@ -8,5 +8,15 @@ urlpatterns = [
     path('api/v1/youtube/callback', views.youtube_callback, name='youtube_callback'),
     path('api/v1/youtube/uploaded-videos/', views.get_uploaded_videos, name='get_uploaded_videos'),
     path('api/v1/youtube/liked-videos/', views.get_liked_videos, name="liked_videos"),
+    path('api/v1/youtube/videos/bulk/', views.get_videos_bulk, name="videos_bulk"),
     path('api/v1/youtube/upload/', views.upload_video, name="credentials"),
+    path('api/v1/youtube/upload/<int:job_id>/', views.upload_status, name="upload_status"),
+    path('api/v1/youtube/upload/batch/', views.upload_batch, name="upload_batch"),
+    path(
+        'api/v1/youtube/upload/batch/<int:batch_id>/',
+        views.upload_batch_status,
+        name="upload_batch_status",
+    ),
+    path('api/v1/youtube/quota/', views.quota_status, name="quota_status"),
+    path('api/v1/youtube/metrics/', views.api_metrics, name="api_metrics"),
 ]
@@ -0,0 +1,228 @@
+"""
+Helpers for listing videos through the YouTube Data API
+"""
+
+import base64
+import binascii
+import json
+
+# Maximum number of items YouTube returns per page or accepts per id list
+MAX_RESULTS = 50
+
+# Fields of the stored and uploaded videos, and of the liked videos
+VIDEO_FIELDS = (
+    "id",
+    "link",
+    "title",
+    "description",
+    "published_at",
+    "like_count",
+    "comment_count",
+    "view_count",
+)
+LIKED_VIDEO_FIELDS = ("id", "link", "title", "description", "likes", "comments", "views")
+
+# Part and property of a videos.list item behind every field
+FIELD_SOURCES = {
+    "id": ("id", "id"),
+    "link": ("id", "id"),
+    "title": ("snippet", "title"),
+    "description": ("snippet", "description"),
+    "published_at": ("snippet", "publishedAt"),
+    "like_count": ("statistics", "likeCount"),
+    "comment_count": ("statistics", "commentCount"),
+    "view_count": ("statistics", "viewCount"),
+    "likes": ("statistics", "likeCount"),
+    "comments": ("statistics", "commentCount"),
+    "views": ("statistics", "viewCount"),
+}
+
+
+def encode_cursor(**values):
+    """
+    Pack the given values into an opaque cursor for the frontend
+    """
+    data = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Unpack a cursor created by encode_cursor, raising ValueError
+    if it is malformed
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeError, json.JSONDecodeError) as exception:
+        raise ValueError("Invalid cursor") from exception
+    if not isinstance(values, dict):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def parse_fields(value, allowed):
+    """
+    Return the fields listed in a comma-separated fields parameter, or
+    every allowed field if it is empty, raising ValueError on unknown ones
+    """
+    if not value:
+        return list(allowed)
+    fields = list(dict.fromkeys(
+        field.strip() for field in value.split(",") if field.strip()
+    ))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown or not fields:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def get_selector(fields):
+    """
+    Return the smallest part list and the partial response selector of
+    a videos.list call returning the given fields
+    """
+    properties = {}
+    for field in fields:
+        part, name = FIELD_SOURCES[field]
+        if part != "id" and name not in properties.setdefault(part, []):
+            properties[part].append(name)
+    items = ",".join(
+        ["id", *(f"{part}({','.join(names)})" for part, names in properties.items())]
+    )
+    return ",".join(properties) or "id", f"items({items}),nextPageToken"
+
+
+def format_video(item, fields):
+    """
+    Return the given fields of a videos.list item
+    """
+    snippet = item.get("snippet", {})
+    statistics = item.get("statistics", {})
+    values = {
+        "id": item["id"],
+        "link": f"https://www.youtube.com/watch?v={item['id']}",
+        "title": snippet.get("title"),
+        "description": snippet.get("description"),
+        "published_at": snippet.get("publishedAt"),
+        "like_count": int(statistics.get("likeCount", 0)),
+        "comment_count": int(statistics.get("commentCount", 0)),
+        "view_count": int(statistics.get("viewCount", 0)),
+        # Liked videos have always returned the counts as YouTube sends them
+        "likes": statistics.get("likeCount", 0),
+        "comments": statistics.get("commentCount", 0),
+        "views": statistics.get("viewCount", 0),
+    }
+    return {field: values[field] for field in fields}
+
+
+def iter_pages(list_page):
+    """
+    Yield every page returned by list_page, a callable taking a page
+    token and returning a page of videos and the next page token
+    """
+    page_token = None
+    while True:
+        videos, page_token = list_page(page_token)
+        yield videos
+        if not page_token:
+            break
+
+
+def get_video_statistics(youtube, video_ids):
+    """
+    Return the statistics of the given videos keyed by video id,
+    requesting them in batches of up to MAX_RESULTS ids per call
+    """
+    statistics_by_id = {}
+    for start in range(0, len(video_ids), MAX_RESULTS):
+        batch = video_ids[start:start + MAX_RESULTS]
+        response = youtube.videos().list(
+            part="statistics",
+            id=",".join(batch),
+            maxResults=MAX_RESULTS,
+        ).execute()
+        for item in response["items"]:
+            statistics_by_id[item["id"]] = item["statistics"]
+    return statistics_by_id
+
+
+def get_video_details(youtube, video_ids, fields=VIDEO_FIELDS):
+    """
+    Return the given fields of up to MAX_RESULTS videos keyed by video
+    id, leaving out the ones YouTube does not know
+    """
+    part, selector = get_selector(fields)
+    response = youtube.videos().list(
+        part=part,
+        id=",".join(video_ids),
+        maxResults=MAX_RESULTS,
+        fields=selector,
+    ).execute()
+    return {item["id"]: format_video(item, fields) for item in response["items"]}
+
+
+def get_uploads_playlist_id(youtube):
+    """
+    Return the id of the playlist holding the user's uploads
+    """
+    channels_response = youtube.channels().list(
+        part="contentDetails", mine=True
+    ).execute()
+    return channels_response["items"][0]["contentDetails"]["relatedPlaylists"][
+        "uploads"
+    ]
+
+
+def list_uploaded_videos(youtube, playlist_id, page_token=None, page_size=MAX_RESULTS):
+    """
+    Return one page of the user's uploaded videos and the token
+    of the next page
+    """
+    response = youtube.playlistItems().list(
+        part="snippet",
+        playlistId=playlist_id,
+        maxResults=page_size,
+        pageToken=page_token
+    ).execute()
+
+    # Retrieve the statistics for the whole page in a single call
+    video_ids = [
+        item["snippet"]["resourceId"]["videoId"] for item in response["items"]
+    ]
+    statistics_by_id = get_video_statistics(youtube, video_ids)
+
+    # Extract relevant information from the response
+    videos = []
+    for item in response["items"]:
+        video_id = item["snippet"]["resourceId"]["videoId"]
+        statistics = statistics_by_id.get(video_id, {})
+        videos.append({
+            "id": video_id,
+            "link": f"https://www.youtube.com/watch?v={video_id}",
+            "title": item["snippet"]["title"],
+            "description": item["snippet"]["description"],
+            "published_at": item["snippet"]["publishedAt"],
+            "like_count": int(statistics.get("likeCount", 0)),
+            "comment_count": int(statistics.get("commentCount", 0)),
+            "view_count": int(statistics.get("viewCount", 0)),
+        })
+    return videos, response.get("nextPageToken")
+
+
+def list_liked_videos(
+    youtube, page_token=None, page_size=MAX_RESULTS, fields=LIKED_VIDEO_FIELDS
+):
+    """
+    Return the given fields of one page of the user's liked videos and
+    the token of the next page
+    """
+    part, selector = get_selector(fields)
+    response = youtube.videos().list(
+        part=part,
+        maxResults=page_size,
+        myRating="like",
+        pageToken=page_token,
+        fields=selector,
+    ).execute()
+    videos = [format_video(item, fields) for item in response["items"]]
+    return videos, response.get("nextPageToken")
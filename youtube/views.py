@@ -1,22 +1,51 @@
-import logging
-import os
-import tempfile
+import datetime
+import hashlib
 import json
+import logging
+from functools import partial
 
-from google_auth_oauthlib.flow import InstalledAppFlow
-from django.http import JsonResponse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
 from django.core.files.uploadedfile import InMemoryUploadedFile
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-from rest_framework.permissions import IsAuthenticated
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from django.utils.dateparse import parse_datetime
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.response import Response
-from .models import OAuthState
-
-current_dir = os.path.dirname(os.path.abspath(__file__))
-json_path = os.path.join(current_dir, "Sss.json")
+from authentication.backends import CachedTokenAuthentication
+from .client import build_youtube
+from .credentials import get_credentials, invalidate_credentials
+from .execution import breaker
+from .models import (
+    ChannelSync,
+    OAuthState,
+    UploadBatch,
+    UploadJob,
+    YouTubeCredentials,
+    YouTubeVideo,
+)
+from .oauth import create_flow
+from .quota import get_quota_report
+from .sync import fetch_batches, sync_uploaded_videos
+from .upload_handlers import StreamedVideo
+from .uploads import finish_job, store_video
+from .videos import (
+    MAX_RESULTS,
+    decode_cursor,
+    LIKED_VIDEO_FIELDS,
+    VIDEO_FIELDS,
+    encode_cursor,
+    get_video_details,
+    iter_pages,
+    list_liked_videos,
+    parse_fields,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -46,28 +75,151 @@ def get_category_id(category_name):
     return category_mapping.get(category_name)
 
 
+# Maximum number of ids accepted by the bulk details endpoint, and how
+# many batches of MAX_RESULTS of them are fetched from YouTube at once
+BULK_MAX_IDS = 500
+BULK_WORKERS = 4
+
+
+def get_page_size(request):
+    """
+    Read the requested page size, clamped to what YouTube allows
+    """
+    try:
+        page_size = int(request.GET.get("page_size", MAX_RESULTS))
+    except ValueError:
+        page_size = MAX_RESULTS
+    return max(1, min(page_size, MAX_RESULTS))
+
+
+def wants_all_pages(request):
+    """
+    Check if the client asked for the whole listing at once
+    """
+    return request.GET.get("all", "").lower() in ("1", "true", "yes")
+
+
+def get_store_version(channel_sync, request):
+    """
+    Return the ETag and modification time of what the given request reads
+    from the local store of the given channel
+    """
+    last_modified = max(
+        filter(None, [channel_sync.synced_at, channel_sync.statistics_refreshed_at])
+    )
+    parameters = sorted(
+        (key, value) for key, value in request.GET.items() if key != "refresh"
+    )
+    version = json.dumps([
+        channel_sync.user_id,
+        str(channel_sync.synced_at),
+        str(channel_sync.statistics_refreshed_at),
+        parameters,
+    ])
+    etag = quote_etag(hashlib.sha1(version.encode()).hexdigest())
+    return etag, int(last_modified.timestamp())
+
+
+def set_store_version(response, etag, last_modified):
+    """
+    Add the validators of the local store to the given response
+    """
+    response.headers["ETag"] = etag
+    response.headers["Last-Modified"] = http_date(last_modified)
+    # Every user sees their own videos behind the same URL
+    patch_vary_headers(response, ["Authorization"])
+    return response
+
+
+def get_stored_videos(user, fields):
+    """
+    Return the stored videos of the given user, newest first, loading
+    only the columns of the given fields and the ones keying the videos
+    """
+    columns = {YouTubeVideo.FIELD_COLUMNS[field] for field in fields}
+    return YouTubeVideo.objects.filter(user=user).only(
+        "pk", "video_id", "published_at", *columns
+    ).order_by("-published_at", "-pk")
+
+
+def iter_stored_pages(videos, fields=None, page_size=500):
+    """
+    Yield the given fields of the given stored videos as pages of dicts,
+    reading them from the database in chunks
+    """
+    page = []
+    for video in videos.iterator(chunk_size=page_size):
+        page.append(video.to_dict(fields))
+        if len(page) == page_size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+# Values of the stream parameter
+STREAM_FORMATS = ("json", "ndjson")
+
+
+def parse_stream_format(value):
+    """
+    Return the format asked for by the stream parameter, or None if it
+    is empty, raising ValueError on unknown ones
+    """
+    if not value:
+        return None
+    if value not in STREAM_FORMATS:
+        raise ValueError(f"stream must be one of {', '.join(STREAM_FORMATS)}")
+    return value
+
+
+def stream_videos(pages, stream_format):
+    """
+    Stream every video as soon as its page arrives, either as one JSON
+    document or as newline-delimited JSON
+    """
+    if stream_format == "ndjson":
+        def content():
+            for videos in pages:
+                yield "".join(json.dumps(video) + "\n" for video in videos)
+
+        return StreamingHttpResponse(content(), content_type="application/x-ndjson")
+
+    def content():
+        yield '{"videos": ['
+        separator = ""
+        for videos in pages:
+            for video in videos:
+                yield separator + json.dumps(video)
+                separator = ", "
+        yield "]}"
+
+    return StreamingHttpResponse(content(), content_type="application/json")
+
+
+def get_pending_states(user):
+    """
+    Return the authorization flows of the given user that have not expired
+    """
+    cutoff = timezone.now() - datetime.timedelta(minutes=settings.YOUTUBE_OAUTH_STATE_TTL)
+    return OAuthState.objects.filter(user=user, created_at__gte=cutoff)
+
+
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def youtube_auth(request):
     """
     Handles user authentication
     """
     # Checks if the user has already connected their YouTube account
-    if OAuthState.objects.filter(user=request.user).exists():
+    if YouTubeCredentials.objects.filter(user=request.user).exists():
         custom_url = "https://app.devnetwork.tech/sites/youtube"
         # User has already connected, redirect them to a different URL
         return JsonResponse({"url": custom_url})
 
-    # Define the OAuth 2.0 scopes required for YouTube API
-    scopes = ["https://www.googleapis.com/auth/youtube.readonly", "https://www.googleapis.com/auth/userinfo.profile", "https://www.googleapis.com/auth/youtube.force-ssl"]
-
     # Set up the OAuth 2.0 flow
-    flow = InstalledAppFlow.from_client_secrets_file(
-        json_path,
-        scopes=scopes,
-        redirect_uri="https://app.devnetwork.tech/user/youtube-callback",
-    )
+    flow = create_flow()
 
     # Generate the authorization URL
     authorization_url, state = flow.authorization_url(
@@ -85,7 +237,7 @@ def youtube_auth(request):
 
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def youtube_callback(request):
     """
@@ -95,19 +247,12 @@ def youtube_callback(request):
     state = request.GET.get("state")
     code = request.GET.get("code")
 
-    # Retrieve the corresponding OAuthState object from the database
-    try:
-        oauth_state = OAuthState.objects.get(user=request.user, state=state)
-    except OAuthState.DoesNotExist:
+    # Check the state belongs to a flow the user started recently
+    if not get_pending_states(request.user).filter(state=state).exists():
         return JsonResponse({"error": "Invalid state"})
 
-    # Create the flow from the client secrets file
-    flow = InstalledAppFlow.from_client_secrets_file(
-        json_path,
-        scopes=["https://www.googleapis.com/auth/youtube.readonly", "https://www.googleapis.com/auth/userinfo.profile", "https://www.googleapis.com/auth/youtube.force-ssl"],
-        state=state,
-        redirect_uri="https://app.devnetwork.tech/user/youtube-callback",
-    )
+    # Create the flow from the preloaded client configuration
+    flow = create_flow(state=state)
 
     # Exchange the authorization code for an access token
     temp_var = request.build_absolute_uri()
@@ -118,226 +263,386 @@ def youtube_callback(request):
         code=code,
     )
 
-    # Store the credentials in the user's database
-    oauth_state = OAuthState.objects.filter(user=request.user).first()
-    credentials = flow.credentials
-
-    # Check if the credentials already have a refresh token
-    if not credentials.refresh_token:
-        # Set the refresh token from the authorization response
-        new_credentials = Credentials(
-            credentials.token,
-            refresh_token=flow.credentials.refresh_token,
-            token_uri=credentials.token_uri,
-            client_id=credentials.client_id,
-            client_secret=credentials.client_secret,
-            scopes=credentials.scopes,
-        )
-        oauth_state.credentials = new_credentials.to_json()
-        oauth_state.save()
-    oauth_state.credentials = credentials.to_json()
-    oauth_state.save()
+    # Store the credentials in the user's database, replacing any
+    # previous ones, and forget the flows the user started
+    YouTubeCredentials.objects.update_or_create(
+        user=request.user, defaults={"credentials": flow.credentials.to_json()}
+    )
+    OAuthState.objects.filter(user=request.user).delete()
+    invalidate_credentials(request.user)
     # request.session['youtube_credentials'] = credentials.to_json()
 
     return JsonResponse({"success": True})
 
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def get_uploaded_videos(request):
     """
-    Return a user videos
+    Return a page of the user videos from the local store, or every video
+    with all=true or stream=json|ndjson. refresh=true pulls the newest
+    videos from YouTube first and refresh=full the whole channel. fields=
+    picks the returned fields
     """
-    # Retrieve the OAuthState object for the current user
-    oauth_state = OAuthState.objects.filter(user=request.user).first()
+    try:
+        fields = parse_fields(request.GET.get("fields"), VIDEO_FIELDS)
+        stream_format = parse_stream_format(request.GET.get("stream"))
+    except ValueError as exception:
+        return JsonResponse({"error": str(exception)}, status=400)
+
+    refresh = request.GET.get("refresh", "").lower()
+    channel_sync = ChannelSync.objects.filter(
+        user=request.user, synced_at__isnull=False
+    ).first()
+    if channel_sync is None or refresh in ("1", "true", "yes", "full"):
+        # Retrieve the live credentials for the current user
+        credentials = get_credentials(request.user)
+        if credentials is None:
+            return JsonResponse({"error": "YouTube account not connected"}, status=400)
+        sync_uploaded_videos(
+            request.user, build_youtube(credentials, request.user), full=refresh == "full"
+        )
+        channel_sync = ChannelSync.objects.get(user=request.user)
 
-    # Retrieve the stored credentials from the OAuthState object
-    credentials_json = oauth_state.credentials
-    credentials_data = json.loads(credentials_json)
-    credentials = Credentials.from_authorized_user_info(credentials_data)
+    # The store only changes when it is synced or its statistics refreshed,
+    # so a client holding the current version gets a 304 without a query
+    etag, last_modified = get_store_version(channel_sync, request)
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if not_modified is not None:
+        return set_store_version(not_modified, etag, last_modified)
 
-    # Create the YouTube Data API client
-    youtube = build("youtube", "v3", credentials=credentials)
-
-    # Retrieve the user's channel ID
-    channels_response = youtube.channels().list(part="id", mine=True).execute()
-    channel_id = channels_response["items"][0]["id"]
-
-    # Perform the API request to get the user's uploaded videos
-    videos = []
-    next_page_token = None
-
-    while True:
-        response = youtube.search().list(
-            part="snippet",
-            channelId=channel_id,
-            type="video",
-            maxResults=50,
-            pageToken=next_page_token
-        ).execute()
-
-        # Extract relevant information from the response and append to the videos list
-        for item in response["items"]:
-            video_id = item["id"]["videoId"]
-            link = f"https://www.youtube.com/watch?v={video_id}"
-            title = item["snippet"]["title"]
-            description = item["snippet"]["description"]
-
-            # Retrieve the video statistics to get the like count, comment count, and view count
-            video_response = youtube.videos().list(
-                part="statistics",
-                id=video_id
-            ).execute()
-
-            statistics = video_response["items"][0]["statistics"]
-            like_count = int(statistics.get("likeCount", 0))
-            comment_count = int(statistics.get("commentCount", 0))
-            view_count = int(statistics.get("viewCount", 0))
-
-            video_info = {
-                "id": video_id,
-                "link": link,
-                "title": title,
-                "description": description,
-                "like_count": like_count,
-                "comment_count": comment_count,
-                "view_count": view_count
-            }
-            videos.append(video_info)
-
-        next_page_token = response.get("nextPageToken")
-        if not next_page_token:
-            break
-
-    return JsonResponse({"videos": videos})
+    videos = get_stored_videos(request.user, fields)
+
+    if stream_format:
+        return set_store_version(
+            stream_videos(iter_stored_pages(videos, fields), stream_format),
+            etag,
+            last_modified,
+        )
+    if wants_all_pages(request):
+        return set_store_version(
+            JsonResponse({"videos": [video.to_dict(fields) for video in videos]}),
+            etag,
+            last_modified,
+        )
+
+    # Keyset pagination on the (published_at, pk) index
+    cursor = request.GET.get("page_token")
+    if cursor:
+        try:
+            values = decode_cursor(cursor)
+            published_at = parse_datetime(values["published_at"])
+            videos = videos.filter(
+                Q(published_at__lt=published_at)
+                | Q(published_at=published_at, pk__lt=values["pk"])
+            )
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({"error": "Invalid page_token"}, status=400)
+
+    page_size = get_page_size(request)
+    page = list(videos[:page_size + 1])
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_cursor = encode_cursor(
+            published_at=page[-1].published_at.isoformat(), pk=page[-1].pk
+        )
+    return set_store_version(
+        JsonResponse({
+            "videos": [video.to_dict(fields) for video in page],
+            "next_cursor": next_cursor,
+        }),
+        etag,
+        last_modified,
+    )
 
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def get_liked_videos(request):
     """
-    Returns a user liked videos
+    Returns a page of the user liked videos, or every video with all=true
+    or stream=json|ndjson. fields= picks the returned fields, which are
+    the only ones requested from YouTube
     """
-    # Retrieve the OAuthState object for the current user
-    oauth_state = OAuthState.objects.filter(user=request.user).first()
+    try:
+        fields = parse_fields(request.GET.get("fields"), LIKED_VIDEO_FIELDS)
+        stream_format = parse_stream_format(request.GET.get("stream"))
+    except ValueError as exception:
+        return JsonResponse({"error": str(exception)}, status=400)
 
-    # Retrieve the stored credentials from the OAuthState object
-    credentials_json = oauth_state.credentials
-    credentials_data = json.loads(credentials_json)
-    credentials = Credentials.from_authorized_user_info(credentials_data)
+    # Retrieve the live credentials for the current user
+    credentials = get_credentials(request.user)
+    if credentials is None:
+        return JsonResponse({"error": "YouTube account not connected"}, status=400)
 
     # Create the YouTube Data API client
-    youtube = build("youtube", "v3", credentials=credentials)
-
-    # Perform the API request to get the user's uploaded videos
-    videos = []
-    next_page_token = None
-
-    while True:
-        response = youtube.videos().list(
-            part="snippet, statistics",
-            maxResults=50,
-            myRating="like",
-            pageToken=next_page_token,
-        ).execute()
-
-        # Extract relevant information from the response and append to the videos list
-        for item in response["items"]:
-            video_id = item["id"]
-            link = f"https://www.youtube.com/watch?v={video_id}"
-            title = item["snippet"]["title"]
-            description = item["snippet"]["description"]
-            likes = item["statistics"].get("likeCount", 0)
-            comments = item["statistics"].get("commentCount", 0)
-            views = item["statistics"].get("viewCount", 0)
-
-
-            video_info = {
-                "id": video_id,
-                "link": link,
-                "title": title,
-                "description": description,
-                "likes": likes,
-                "comments": comments,
-                "views": views,
-            }
-            videos.append(video_info)
-
-        next_page_token = response.get("nextPageToken")
-        if not next_page_token:
-            break
-
-    return JsonResponse({"videos": videos})
+    youtube = build_youtube(credentials, request.user)
+
+    if stream_format or wants_all_pages(request):
+        pages = iter_pages(partial(list_liked_videos, youtube, fields=fields))
+        if stream_format:
+            return stream_videos(pages, stream_format)
+        videos = [video for page in pages for video in page]
+        return JsonResponse({"videos": videos})
+
+    cursor = request.GET.get("page_token")
+    page_token = None
+    if cursor:
+        try:
+            page_token = decode_cursor(cursor)["token"]
+        except (ValueError, KeyError):
+            return JsonResponse({"error": "Invalid page_token"}, status=400)
+
+    videos, next_page_token = list_liked_videos(
+        youtube, page_token, get_page_size(request), fields
+    )
+    next_cursor = None
+    if next_page_token:
+        next_cursor = encode_cursor(token=next_page_token)
+    return JsonResponse({"videos": videos, "next_cursor": next_cursor})
 
 
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def get_videos_bulk(request):
+    """
+    Returns the details of the given videos, reading the ones in the
+    local store from the database and fetching the rest from YouTube.
+    fields= picks the returned fields
+    """
+    try:
+        fields = parse_fields(request.GET.get("fields"), VIDEO_FIELDS)
+    except ValueError as exception:
+        return JsonResponse({"error": str(exception)}, status=400)
+
+    video_ids = request.data.get("ids") if isinstance(request.data, dict) else None
+    if not isinstance(video_ids, list) or not all(
+        isinstance(video_id, str) and video_id for video_id in video_ids
+    ):
+        return JsonResponse({"error": "ids must be a list of video ids"}, status=400)
+    video_ids = list(dict.fromkeys(video_ids))
+    if len(video_ids) > BULK_MAX_IDS:
+        return JsonResponse(
+            {"error": f"At most {BULK_MAX_IDS} ids can be requested at once"}, status=400
+        )
+
+    videos_by_id = {
+        video.video_id: video.to_dict(fields)
+        for video in get_stored_videos(request.user, fields).filter(video_id__in=video_ids)
+    }
+    unknown_ids = [video_id for video_id in video_ids if video_id not in videos_by_id]
+    if unknown_ids:
+        credentials = get_credentials(request.user)
+        if credentials is None:
+            return JsonResponse({"error": "YouTube account not connected"}, status=400)
+        videos_by_id.update(fetch_batches(
+            request.user,
+            credentials,
+            unknown_ids,
+            partial(get_video_details, fields=fields),
+            BULK_WORKERS,
+        ))
+
+    return JsonResponse({
+        "videos": [videos_by_id[video_id] for video_id in video_ids if video_id in videos_by_id],
+        "missing": [video_id for video_id in video_ids if video_id not in videos_by_id],
+    })
+
+
+def create_upload_job(user, metadata, video):
+    """
+    Build the upload job of the given video from the title, description,
+    visibility, category and made_for_kids of the given metadata
+    """
+    return UploadJob(
+        user=user,
+        title=metadata.get("title"),
+        description=metadata.get("description"),
+        visibility=metadata.get("visibility"),
+        category_id=get_category_id(metadata.get("category")),
+        made_for_kids=str(metadata.get("made_for_kids", False)).lower() in ("true", "1"),
+        total_bytes=video.size,
+    )
+
+
+def get_job_status(job):
+    """
+    Return the status and progress of the given upload job
+    """
+    return {
+        "job_id": job.pk,
+        "status": job.status,
+        "uploaded_bytes": job.uploaded_bytes,
+        "total_bytes": job.total_bytes,
+        "video_id": job.video_id,
+        "error": job.error,
+    }
+
+
+@api_view(['POST'])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def upload_video(request):
     """
-    Enables a user to upload a vidoe directly to youtube
+    Queues a video to be uploaded to youtube by the upload worker, or
+    uploads it while it is received with pipeline=true
     """
-    video_title = request.data.get('title')
-    video_description = request.data.get('description')
-    video_visibility = request.data.get('visibility')
-    video_category = request.data.get('category')
     video_location = request.FILES.get('video')
-    video_made_for_kids = request.data.get('made_for_kids', False)
-
-    category_id = get_category_id(video_category)
 
-    # Retrieve the OAuthState object for the current user
-    oauth_state = OAuthState.objects.filter(user=request.user).first()
+    if not video_location:
+        # Video file not found in request, return error
+        return Response({"error": "Video file not found in the request."}, status=400)
+
+    if not YouTubeCredentials.objects.filter(user=request.user).exists():
+        return JsonResponse({"error": "YouTube account not connected"}, status=400)
+
+    job = create_upload_job(request.user, request.data, video_location)
+
+    if isinstance(video_location, StreamedVideo):
+        # The video was forwarded to YouTube while the request was read,
+        # only its metadata is left to set
+        job.status = UploadJob.RUNNING
+        job.save()
+        try:
+            video_id = video_location.finish(job)
+        # pylint: disable=broad-exception-caught
+        except Exception as exception:
+            logger.error(str(exception))
+            finish_job(job, UploadJob.FAILED, error=str(exception))
+            return Response({"success": False, "job_id": job.pk})
+        finish_job(
+            job, UploadJob.COMPLETED, uploaded_bytes=job.total_bytes, video_id=video_id
+        )
+        return Response({"success": True, "job_id": job.pk, "video_id": video_id})
+
+    job.file_path = store_video(video_location)
+    job.save()
+
+    return Response(
+        {
+            "success": True,
+            "job_id": job.pk,
+            "status_url": reverse("youtube:upload_status", args=[job.pk]),
+        },
+        status=202,
+    )
 
-    # Retrieve the stored credentials from the OAuthState object
-    credentials_json = oauth_state.credentials
-    credentials_data = json.loads(credentials_json)
-    credentials = Credentials.from_authorized_user_info(credentials_data)
 
-    # Create the YouTube Data API client
-    youtube = build("youtube", "v3", credentials=credentials)
-    # Create a temporary file to save the video content
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        for chunk in video_location.chunks():
-            temp_file.write(chunk)
-        temp_file_path = temp_file.name
+@api_view(['POST'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def upload_batch(request):
+    """
+    Queues several videos to be uploaded to youtube by the upload worker.
+    The metadata field holds a JSON list with the title, description,
+    visibility, category and made_for_kids of every video, in order
+    """
+    videos = request.FILES.getlist("videos")
+    if not videos:
+        return Response({"error": "Video files not found in the request."}, status=400)
+    if len(videos) > settings.YOUTUBE_UPLOAD_BATCH_MAX_FILES:
+        return JsonResponse({
+            "error": f"At most {settings.YOUTUBE_UPLOAD_BATCH_MAX_FILES} videos "
+                     f"can be uploaded at once"
+        }, status=400)
 
     try:
-        if video_location:
-            media = MediaFileUpload(
-                    temp_file_path,
-                    chunksize=-1,
-                    resumable=True
-                )
-            response = youtube.videos().insert(
-                part="snippet,status",
-                body={
-                    "snippet": {
-                        "title": video_title,
-                        "description": video_description,
-                        "categoryId": category_id,
-                        "defaultLanguage": "en",
-                        "defaultAudioLanguage": "en"
-                    },
-                    "status": {
-                        "privacyStatus": video_visibility,
-                        "selfDeclaredMadeForKids": video_made_for_kids
-                    }
-                },
-                media_body=media
-            ).execute()
-
-            # Video upload successful, return True
-            return Response({"success": True})
-        else:
-            # Video file not found in request, return error
-            return Response({"error": "Video file not found in the request."}, status=400)
-    except Exception as e:
-        # Video upload failed, return error message or additional details
-        logger.error(str(e))
-        return Response({"success": False})
-    finally:
-        # Delete the temporary file
-        os.remove(temp_file_path)
+        metadata = json.loads(request.data.get("metadata") or "[]")
+    except json.JSONDecodeError:
+        metadata = None
+    if not isinstance(metadata, list) or len(metadata) > len(videos) or not all(
+        isinstance(video_metadata, dict) for video_metadata in metadata
+    ):
+        return JsonResponse(
+            {"error": "metadata must be a JSON list with one object per video"}, status=400
+        )
+    # Videos without metadata get the defaults of upload_video
+    metadata += [{}] * (len(videos) - len(metadata))
+
+    if not YouTubeCredentials.objects.filter(user=request.user).exists():
+        return JsonResponse({"error": "YouTube account not connected"}, status=400)
+
+    # Django spooled every large video to disk while the request was read,
+    # store_video only moves them to the upload directory
+    jobs = []
+    with transaction.atomic():
+        batch = UploadBatch.objects.create(user=request.user)
+        for video, video_metadata in zip(videos, metadata):
+            job = create_upload_job(request.user, video_metadata, video)
+            job.batch = batch
+            job.file_path = store_video(video)
+            job.save()
+            jobs.append(job)
+
+    return Response(
+        {
+            "success": True,
+            "batch_id": batch.pk,
+            "status_url": reverse("youtube:upload_batch_status", args=[batch.pk]),
+            "videos": [
+                {
+                    "name": video.name,
+                    "job_id": job.pk,
+                    "status_url": reverse("youtube:upload_status", args=[job.pk]),
+                }
+                for video, job in zip(videos, jobs)
+            ],
+        },
+        status=202,
+    )
+
+
+@api_view(['GET'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def upload_status(request, job_id):
+    """
+    Returns the status and progress of an upload job
+    """
+    job = get_object_or_404(UploadJob, pk=job_id, user=request.user)
+    return JsonResponse(get_job_status(job))
+
+
+@api_view(['GET'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def upload_batch_status(request, batch_id):
+    """
+    Returns the status and progress of every video of a batch upload
+    """
+    batch = get_object_or_404(UploadBatch, pk=batch_id, user=request.user)
+    jobs = list(batch.jobs.order_by("pk"))
+    return JsonResponse({
+        "batch_id": batch.pk,
+        "completed": sum(job.status == UploadJob.COMPLETED for job in jobs),
+        "failed": sum(job.status == UploadJob.FAILED for job in jobs),
+        "uploaded_bytes": sum(job.uploaded_bytes for job in jobs),
+        "total_bytes": sum(job.total_bytes for job in jobs),
+        "videos": [get_job_status(job) for job in jobs],
+    })
+
+
+@api_view(['GET'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAdminUser])
+def quota_status(request):
+    """
+    Shows staff how much of the YouTube quota is left today
+    """
+    return JsonResponse(get_quota_report())
+
+
+@api_view(['GET'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAdminUser])
+def api_metrics(request):
+    """
+    Shows staff the state of the YouTube circuit breaker in this process
+    """
+    return JsonResponse({"circuit_breaker": breaker.metrics()})